@@ -53,11 +53,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'LittleLemonAPI.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'LittleLemonAPI.routers.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -93,6 +95,34 @@ DATABASES = {
     }
 }
 
+# Read replicas for the menu, category and order lists, e.g.
+# DATABASE_REPLICAS=replica.sqlite3 with a copy of db.sqlite3 to try it locally
+DATABASE_REPLICAS = []
+for index, name in enumerate(env.list('DATABASE_REPLICAS', default=[]), 1):
+    DATABASES[f'replica{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / name,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{index}')
+
+DATABASE_ROUTERS = ['LittleLemonAPI.routers.ReplicaRouter']
+# reads of a user or scope stay on the primary this long after a write
+REPLICA_LAG_SECONDS = env.int('REPLICA_LAG_SECONDS', default=5)
+
+# Catalog pages go to the default cache, which may drop them when full. Versions, roles and
+# replica pins are how one worker tells the others of a write, they go to 'versions', which
+# every worker shares and which must not drop entries at random. The file caches are shared
+# on this host, like the SQLite database, set CACHE_URL and VERSIONS_CACHE_URL (e.g.
+# redis://host:6379/0 and redis://host:6379/1) once workers run on several hosts.
+CACHES = {
+    'default': env.cache_url('CACHE_URL', default=f'filecache://{BASE_DIR / "cache" / "pages"}'),
+    'versions': env.cache_url('VERSIONS_CACHE_URL', default=f'filecache://{BASE_DIR / "cache" / "versions"}'),
+}
+if CACHES['versions']['BACKEND'].endswith(('FileBasedCache', 'LocMemCache')):
+    # these cull a third of their entries once MAX_ENTRIES (300 by default) is reached
+    CACHES['versions'].setdefault('OPTIONS', {}).setdefault('MAX_ENTRIES', 1_000_000)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -137,9 +167,19 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'LittleLemonAPI.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
+    # orjson backed when installed, the stdlib json otherwise
+    'DEFAULT_RENDERER_CLASSES': [
+        'LittleLemonAPI.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'LittleLemonAPI.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
         # 'rest_framework.filters.OrderingFilter',
@@ -152,6 +192,35 @@ REST_FRAMEWORK = {
     }
 }
 
+# tokens with their users and roles kept per worker by CachedTokenAuthentication
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_CACHE_TIMEOUT = 300
+
+# token buckets of the throttles in LittleLemonAPI.throttling, shared by all workers on the host
+THROTTLE_STORE = env('THROTTLE_STORE', default=str(BASE_DIR / 'throttle.sqlite3'))
+
 DJOSER = {
     'USEER_ID_FIELD': 'username',
-}
\ No newline at end of file
+}
+
+# RequestTimingMiddleware logs requests slower than this with their costliest SQL
+SLOW_REQUEST_MS = env.int('SLOW_REQUEST_MS', default=500)
+SLOW_REQUEST_TOP_SQL = 5
+
+# checkout gives new orders to the least loaded delivery crew member, see LittleLemonAPI.dispatch
+DISPATCH_AT_CHECKOUT = env.bool('DISPATCH_AT_CHECKOUT', default=True)
+# each worker recounts open orders this often, it only sees its own assignments in between
+DISPATCH_REFRESH_SECONDS = env.int('DISPATCH_REFRESH_SECONDS', default=60)
+
+# long polls on /api/orders/<pk>/events are held this long, one thread per process polls the feed
+ORDER_EVENTS_TIMEOUT = env.int('ORDER_EVENTS_TIMEOUT', default=25)
+ORDER_EVENTS_POLL_SECONDS = 0.5
+ORDER_EVENTS_RETENTION = 24 * 60 * 60
+
+# POST /api/orders with Prefer: respond-async, or every one with CHECKOUT_ASYNC, queues the
+# checkout for run_checkout_jobs. Failed jobs retry with doubling delays, after the last
+# attempt the cart is given back. Running jobs older than the timeout are taken over.
+CHECKOUT_ASYNC = env.bool('CHECKOUT_ASYNC', default=False)
+CHECKOUT_JOB_ATTEMPTS = 5
+CHECKOUT_JOB_RETRY_SECONDS = 2
+CHECKOUT_JOB_TIMEOUT = 300
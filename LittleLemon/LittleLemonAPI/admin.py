@@ -1,9 +1,10 @@
 from django.contrib import admin
-from .models import Category, MenuItem, Order, OrderItem, Cart
+from .models import Category, MenuItem, Order, OrderItem, Cart, DailySales
 
 # Register your models here.
 admin.site.register(Category)
 admin.site.register(MenuItem)
 admin.site.register(Order)
 admin.site.register(OrderItem)
-admin.site.register(Cart)
\ No newline at end of file
+admin.site.register(Cart)
+admin.site.register(DailySales)
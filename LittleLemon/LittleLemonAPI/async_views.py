@@ -0,0 +1,204 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.http import HttpResponse, Http404
+from django.views import View
+
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+
+from .authentication import CachedTokenAuthentication
+from .events import event_rows, feed
+from .fastlists import attach_nested, nested_values, represent, row_keys, value_columns, value_keys
+from .middleware import idle
+from .models import Order, OrderEvent
+from .pagination import apaginate_queryset
+from .permissions import get_roles, order_users
+from .renderers import FastJSONRenderer
+from .routers import ReplicaReadMixin, replica_reads
+from . import views
+
+
+async def get_user(request):
+    """Token, then session authentication, like DEFAULT_AUTHENTICATION_CLASSES."""
+    header = request.headers.get('Authorization', '').split()
+    if len(header) == 2 and header[0].lower() == 'token':
+        # a cache hit does no SQL, a miss fills the cache like the sync views do
+        user, _ = await sync_to_async(CachedTokenAuthentication().authenticate_credentials)(header[1])
+        return user
+    return await sync_to_async(auth.get_user)(request)
+
+
+class AsyncReadView(View):
+    """
+    Read-only GET on the async ORM for one of the DRF views in views.py.
+
+    Filtering, ordering, pagination and fields come from `view_class`, and
+    rows are built like ValuesListMixin does, so the JSON body is the same
+    as the sync endpoint's. Under ASGI a request waiting on the database
+    holds no thread of its own.
+    """
+    view_class = None
+    login_required = False
+    renderer = FastJSONRenderer()
+
+    async def get(self, request, *args, **kwargs):
+        replica_token = None
+        try:
+            user = await get_user(request)
+            if self.login_required and not user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            if user.is_authenticated:
+                # roles are kept on the user, sync permission code reads them without SQL
+                await sync_to_async(get_roles)(user)
+            drf_request = Request(request)
+            drf_request.user = user
+            view = self.view_class(request=drf_request, args=args, kwargs=kwargs, format_kwarg=None)
+            view.check_permissions(drf_request)
+            # the sync route's throttles and buckets, the store is SQLite
+            await sync_to_async(view.check_throttles)(drf_request)
+            if isinstance(view, ReplicaReadMixin):
+                allowed = await sync_to_async(view.allow_replica)(drf_request)
+                replica_token = replica_reads.set(allowed)
+            data = await self.get_data(view, drf_request, *args, **kwargs)
+        except Http404:
+            return self.render({'detail': 'Not found.'}, status.HTTP_404_NOT_FOUND)
+        except exceptions.APIException as exc:
+            response = self.render({'detail': exc.detail}, exc.status_code)
+            if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+                response['WWW-Authenticate'] = 'Token'
+            if getattr(exc, 'wait', None):
+                response['Retry-After'] = '%d' % exc.wait
+            return response
+        finally:
+            if replica_token is not None:
+                replica_reads.reset(replica_token)
+        return self.render(data)
+
+    async def get_data(self, view, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def render(self, data, status_code=status.HTTP_200_OK):
+        return HttpResponse(self.renderer.render(data), content_type=self.renderer.media_type, status=status_code)
+
+
+class AsyncListView(AsyncReadView):
+
+    async def get_data(self, view, request, *args, **kwargs):
+        serializer = view.get_serializer()
+        columns = value_columns(serializer)
+        # filterset validation may look up related rows, it runs on the sync side
+        queryset = await sync_to_async(view.filter_queryset)(view.get_queryset())
+        queryset = queryset.prefetch_related(None).values(*row_keys(view, columns))
+
+        rows = await apaginate_queryset(view.paginator, queryset, request, view)
+        data = [represent(columns, row) for row in rows]
+        for name, (nested_class, foreign_key) in getattr(view, 'values_nested', {}).items():
+            if name in serializer.fields:
+                nested_columns, nested_rows = nested_values(nested_class, foreign_key, rows)
+                nested_rows = [row async for row in nested_rows]
+                attach_nested(data, rows, name, nested_columns, foreign_key, nested_rows)
+        return view.paginator.get_paginated_response(data).data
+
+
+class AsyncDetailView(AsyncReadView):
+    # read along with the fields, whatever ?fields= leaves out
+    permission_keys = set()
+
+    async def get_data(self, view, request, *args, **kwargs):
+        serializer = view.get_serializer()
+        columns = value_columns(serializer)
+        keys = value_keys(columns) | {'id'} | self.permission_keys
+        queryset = view.get_queryset()
+        try:
+            row = await queryset.prefetch_related(None).values(*keys).aget(pk=kwargs['pk'])
+        except queryset.model.DoesNotExist:
+            raise Http404
+        self.check_row_permissions(view, request, row)
+
+        data = represent(columns, row)
+        for name, (nested_class, foreign_key) in getattr(self, 'values_nested', {}).items():
+            if name in serializer.fields:
+                nested_columns, nested_rows = nested_values(nested_class, foreign_key, [row])
+                nested_rows = [nested_row async for nested_row in nested_rows]
+                attach_nested([data], [row], name, nested_columns, foreign_key, nested_rows)
+        return data
+
+    def check_row_permissions(self, view, request, row):
+        pass
+
+
+class MenuItemListView(AsyncListView):
+    view_class = views.MenuItemView
+
+
+class MenuItemDetailView(AsyncDetailView):
+    view_class = views.MenuItemDetailView
+
+
+class CategoryListView(AsyncListView):
+    view_class = views.CategoryView
+
+
+class CategoryDetailView(AsyncDetailView):
+    view_class = views.CategoryDetail
+
+
+class OrderListView(AsyncListView):
+    view_class = views.OrderView
+    login_required = True
+
+
+class OrderDetailView(AsyncDetailView):
+    view_class = views.OrderDerailView
+    login_required = True
+    values_nested = {'order_items': (views.OrderItemSerializer, 'order')}
+    permission_keys = {'user', 'delivery_crew'}
+
+    def check_row_permissions(self, view, request, row):
+        view.check_object_permissions(request, order_users(row))
+
+
+class OrderEventsView(OrderDetailView):
+    """
+    Long poll for changes of one order. Events after ?after= come back at
+    once, with none the request waits for the order feed until the next
+    change or ORDER_EVENTS_TIMEOUT, an optional ?timeout= shortens it.
+    Pass the returned cursor as `after` next time, without one the request
+    waits for the next change.
+    """
+
+    async def get_data(self, view, request, *args, **kwargs):
+        try:
+            row = await Order.objects.values('user', 'delivery_crew').aget(pk=kwargs['pk'])
+        except Order.DoesNotExist:
+            raise Http404
+        self.check_row_permissions(view, request, row)
+        after, timeout = self.get_params(request)
+        if after is None:
+            after = await OrderEvent.objects.order_by('-id').values_list('id', flat=True).afirst() or 0
+
+        # subscribed before looking, a change in between is not missed
+        future = await feed.subscribe(kwargs['pk'], after)
+        try:
+            events = [event async for event in event_rows(OrderEvent.objects.filter(order=kwargs['pk'], id__gt=after))]
+            if not events and timeout > 0:
+                try:
+                    with idle():
+                        events = await asyncio.wait_for(future, timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            feed.unsubscribe(kwargs['pk'], future)
+        return {'cursor': events[-1]['id'] if events else after, 'events': events}
+
+    def get_params(self, request):
+        longest = getattr(settings, 'ORDER_EVENTS_TIMEOUT', 25)
+        try:
+            after = request.query_params.get('after')
+            timeout = float(request.query_params.get('timeout', longest))
+            return (None if after is None else int(after)), min(max(timeout, 0), longest)
+        except ValueError:
+            raise exceptions.ParseError('after must be an event id and timeout a number of seconds.')
@@ -0,0 +1,120 @@
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .caching import bump_version, get_version
+from .permissions import get_roles
+
+
+logger = logging.getLogger(__name__)
+
+
+def auth_version_key(user_id):
+    return f'auth:{user_id}:version'
+
+
+def invalidate_auth(*user_ids):
+    """Cached tokens of these users are looked up again, in every worker sharing the cache."""
+    for user_id in user_ids:
+        bump_version(auth_version_key(user_id))
+
+
+def current_version(user_id):
+    """The user's auth version in the shared cache, None when it cannot be read, which no entry matches."""
+    try:
+        return caches['versions'].get(auth_version_key(user_id))
+    except Exception:
+        return None
+
+
+class TokenCache:
+    """A bounded LRU of token key -> (token, auth version, expiry), safe across threads."""
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, token, version):
+        with self.lock:
+            self.entries[key] = (token, version, time.monotonic() + self.timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache(
+    getattr(settings, 'AUTH_TOKEN_CACHE_SIZE', 10000),
+    getattr(settings, 'AUTH_TOKEN_CACHE_TIMEOUT', 300),
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication with the token, its user and the user's roles kept
+    in token_cache. A hit costs one lookup of the user's auth version in the
+    shared cache and no SQL, signals bump the version on logout, user saves
+    and group changes. While the shared cache is unreachable every request
+    is checked against the database. Every request gets its own copy of the user.
+    """
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is not None:
+            token, version = entry[:2]
+            if current_version(token.user_id) == version:
+                return self.copy_result(token)
+            token_cache.delete(key)
+
+        model = self.get_model()
+        try:
+            token = model.objects.select_related('user').get(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        # read before the roles, a change meanwhile leaves a version that no longer matches
+        try:
+            version = get_version(auth_version_key(token.user_id))
+        except Exception:
+            # without the shared cache a revocation elsewhere would go unseen, nothing is kept
+            logger.warning('cache unreachable, token of user %s checked against the database', token.user_id)
+            return self.copy_result(token)
+        get_roles(token.user)
+        token_cache.set(key, token, version)
+        return self.copy_result(token)
+
+    def copy_result(self, token):
+        token = copy.copy(token)
+        token.user = copy.copy(token.user)
+        return token.user, token
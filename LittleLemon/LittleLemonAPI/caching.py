@@ -0,0 +1,129 @@
+import hashlib
+import random
+import time
+
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.utils.http import urlencode, quote_etag, parse_etags
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from .routers import pin_to_primary
+
+
+CATALOG_VERSION_KEY = 'catalog:version'
+ORDERS_VERSION_KEY = 'orders:version'
+CATALOG_CACHE_TIMEOUT = 60 * 60
+# a version that expires comes back as a new one, which only costs a cache miss
+VERSION_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def new_version():
+    # a timestamp with random low bits, no two bumps write the same value
+    return time.time_ns() << 16 | random.getrandbits(16)
+
+
+def get_version(key):
+    return caches['versions'].get_or_set(key, new_version, VERSION_TIMEOUT)
+
+
+def bump_version(key):
+    # a new value rather than incr(), which the file cache does as a get and a set:
+    # two workers bumping at once would write the same number and one bump is lost
+    caches['versions'].set(key, new_version(), VERSION_TIMEOUT)
+
+
+def user_orders_version_key(user_id):
+    # the orders a user owns or delivers
+    return f'orders:user:{user_id}:version'
+
+
+def get_catalog_version():
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    # once the write commits, a reader in between could otherwise cache the old rows under the new version
+    transaction.on_commit(retire_catalog)
+
+
+def retire_catalog():
+    # pinned first, no cached page or ETag of the new version is built from a lagging replica
+    pin_to_primary('catalog')
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def bump_order_version(user_ids):
+    """
+    Retire the order ETags of these owners and crew members, and of the
+    managers who see every order, once the write commits. The users read
+    their orders from the primary for a while, everyone else may stay on a
+    replica. One bump per user, however many of their orders changed.
+    """
+    users = {user_id for user_id in user_ids if user_id is not None}
+    # after the commit, like the catalog, no ETag of the new version is built from old rows
+    transaction.on_commit(lambda: retire_orders(users))
+
+
+def retire_orders(user_ids):
+    pin_to_primary(*[f'user:{user_id}' for user_id in user_ids])
+    bump_version(ORDERS_VERSION_KEY)
+    for user_id in user_ids:
+        bump_version(user_orders_version_key(user_id))
+
+
+def request_fingerprint(request):
+    # host is part of it since paginated responses carry absolute links
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    url = f'{request.get_host()}{request.path}?{query}'
+    return hashlib.sha1(url.encode()).hexdigest()
+
+
+def catalog_cache_key(request):
+    return f'catalog:{get_catalog_version()}:{request_fingerprint(request)}'
+
+
+class CatalogCacheMixin:
+    """Serve catalog GETs from the cache until the next menu or category write."""
+
+    def get(self, request, *args, **kwargs):
+        key = catalog_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, CATALOG_CACHE_TIMEOUT)
+        return response
+
+
+class ConditionalGetMixin:
+    """Answer GETs with 304 when the client's ETag still matches.
+
+    The ETag is a hash of version counters and the request, so it is known
+    before the queryset is touched or the body serialized.
+    """
+
+    def get_etag_parts(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def check_etag_permissions(self, request, *args, **kwargs):
+        """Object permissions of detail views, checked before a 304 tells the object is there and unchanged."""
+
+    def get(self, request, *args, **kwargs):
+        parts = self.get_etag_parts(request, *args, **kwargs)
+        etag = quote_etag(hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest())
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            # only here, a 200 checks them along with reading the object
+            self.check_etag_permissions(request, *args, **kwargs)
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+        return response
+
+
+class CatalogETagMixin(ConditionalGetMixin):
+    def get_etag_parts(self, request, *args, **kwargs):
+        return [get_catalog_version(), request_fingerprint(request)]
@@ -0,0 +1,213 @@
+import datetime
+import logging
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Q, Case, Subquery, When, Value, prefetch_related_objects
+from django.http import Http404
+from django.utils import timezone
+
+from .dispatch import assign_crew, release_crew
+from .models import Cart, CheckoutJob, MenuItem, Order, OrderItem, DailySales
+
+
+logger = logging.getLogger(__name__)
+
+
+def cart_lines(user):
+    # one joined read: unit and line prices are computed by the database
+    return list(
+        Cart.objects.filter(user=user).with_prices()
+        .values('id', 'menuitem_id', 'quantity', 'line_unit_price', 'line_price')
+    )
+
+
+def add_daily_sales(date, lines):
+    """Add the cart lines to the day's rollup rows in two statements."""
+    DailySales.objects.bulk_create(
+        [DailySales(date=date, menuitem_id=line['menuitem_id']) for line in lines],
+        ignore_conflicts=True,
+    )
+    # F() keeps the increments atomic when checkouts run side by side
+    DailySales.objects.filter(date=date, menuitem_id__in=[line['menuitem_id'] for line in lines]).update(
+        orders=F('orders') + 1,
+        quantity=F('quantity') + Case(
+            *[When(menuitem_id=line['menuitem_id'], then=Value(line['quantity'])) for line in lines]
+        ),
+        revenue=F('revenue') + Case(
+            *[When(menuitem_id=line['menuitem_id'], then=Value(line['line_price'])) for line in lines],
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+    )
+
+
+def remove_daily_sales(item):
+    """Take a deleted order item back out of its day's rollup row."""
+    sales = DailySales.objects.filter(
+        date=Order.objects.filter(pk=item.order_id).values('date')[:1], menuitem_id=item.menuitem_id,
+    )
+    sales.update(orders=F('orders') - 1, quantity=F('quantity') - item.quantity, revenue=F('revenue') - item.price)
+    # rebuild_daily_sales has no rows for days without sales, neither does the rollup
+    sales.filter(orders=0).delete()
+
+
+def remove_order_sales(order):
+    """Take a deleted order back out of its day's rollup rows in two statements."""
+    items = OrderItem.objects.filter(order=order, menuitem=OuterRef('menuitem'))
+    sales = DailySales.objects.filter(
+        date=order.date, menuitem__in=OrderItem.objects.filter(order=order).values('menuitem'),
+    )
+    # an order holds a menu item once, each row loses one order and that item's line
+    sales.update(
+        orders=F('orders') - 1,
+        quantity=F('quantity') - Subquery(items.values('quantity')[:1]),
+        revenue=F('revenue') - Subquery(items.values('price')[:1]),
+    )
+    sales.filter(orders=0).delete()
+
+
+def place_order(user, lines):
+    """Create the order, its items and the sales rollup for cart lines as read by cart_lines."""
+    crew_id = assign_crew()
+    try:
+        order = Order.objects.create(
+            user=user, total=sum(line['line_price'] for line in lines), delivery_crew_id=crew_id,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                menuitem_id=line['menuitem_id'],
+                quantity=line['quantity'],
+                unit_price=line['line_unit_price'],
+                price=line['line_price'],
+            ) for line in lines
+        ])
+        add_daily_sales(order.date, lines)
+    except BaseException:
+        # the checkout rolls back, the crew member is one order lighter again
+        release_crew(crew_id)
+        raise
+    # the response lists the items, fetch them with their menu items at once
+    prefetch_related_objects([order], 'order_items__menuitem')
+    return order
+
+
+@transaction.atomic
+def checkout_cart(user):
+    """Turn the user's cart into an order with a constant number of queries."""
+    lines = cart_lines(user)
+    if not lines:
+        raise Http404('your cart has no item in it, no order placed.')
+    order = place_order(user, lines)
+    # only the lines that were ordered, items added meanwhile stay in the cart
+    Cart.objects.filter(pk__in=[line['id'] for line in lines]).delete()
+    return order
+
+
+@transaction.atomic
+def enqueue_checkout(user):
+    """
+    Move the cart into a queued CheckoutJob at today's prices, the order is
+    placed by run_checkout_jobs. The customer may fill a new cart meanwhile.
+    """
+    lines = cart_lines(user)
+    if not lines:
+        raise Http404('your cart has no item in it, no order placed.')
+    job = CheckoutJob.objects.create(user=user, lines=[
+        {
+            'menuitem_id': line['menuitem_id'], 'quantity': line['quantity'],
+            'line_unit_price': str(line['line_unit_price']), 'line_price': str(line['line_price']),
+        } for line in lines
+    ])
+    Cart.objects.filter(pk__in=[line['id'] for line in lines]).delete()
+    return job
+
+
+def job_lines(job):
+    return [
+        {**line, 'line_unit_price': Decimal(line['line_unit_price']), 'line_price': Decimal(line['line_price'])}
+        for line in job.lines
+    ]
+
+
+class ClaimLost(Exception):
+    """The job was claimed again by another worker before this one finished it."""
+
+
+def claim_checkout_jobs(batch_size):
+    """Mark the next due jobs running and return them, jobs of a worker that died are due again."""
+    now = timezone.now()
+    lost = now - datetime.timedelta(seconds=getattr(settings, 'CHECKOUT_JOB_TIMEOUT', 300))
+    due = CheckoutJob.objects.filter(
+        Q(status=CheckoutJob.QUEUED, run_after__lte=now) | Q(status=CheckoutJob.RUNNING, updated__lt=lost)
+    )
+    claim = uuid.uuid4()
+    # one conditional UPDATE: a job still due when it runs is stamped by a
+    # single worker, SQLite ignores the row locks skip_locked would rely on
+    due.filter(pk__in=due.order_by('id').values('pk')[:batch_size]).update(
+        status=CheckoutJob.RUNNING, claim=claim, attempts=F('attempts') + 1, updated=now,
+    )
+    return list(CheckoutJob.objects.filter(claim=claim).select_related('user').order_by('id'))
+
+
+def update_claimed_job(job, **fields):
+    """Write the job while the worker's claim holds it, returns whether it did."""
+    return bool(
+        CheckoutJob.objects.filter(pk=job.pk, status=CheckoutJob.RUNNING, claim=job.claim)
+        .update(updated=timezone.now(), **fields)
+    )
+
+
+def run_checkout_job(job):
+    try:
+        with transaction.atomic():
+            order = place_order(job.user, job_lines(job))
+            if not update_claimed_job(job, status=CheckoutJob.DONE, order=order, error=''):
+                # the worker that claimed it since places the order, this one goes
+                raise ClaimLost
+        return True
+    except ClaimLost:
+        logger.warning('checkout job %s was claimed again, attempt %s rolled back', job.pk, job.attempts)
+        return False
+    except Exception as exc:
+        logger.exception('checkout job %s failed, attempt %s', job.pk, job.attempts)
+        error = f'{type(exc).__name__}: {exc}'
+    if job.attempts < getattr(settings, 'CHECKOUT_JOB_ATTEMPTS', 5):
+        delay = getattr(settings, 'CHECKOUT_JOB_RETRY_SECONDS', 2) * 2 ** (job.attempts - 1)
+        update_claimed_job(
+            job, status=CheckoutJob.QUEUED, run_after=timezone.now() + datetime.timedelta(seconds=delay), error=error,
+        )
+    else:
+        with transaction.atomic():
+            if update_claimed_job(job, status=CheckoutJob.FAILED, error=error):
+                restore_cart(job)
+    return False
+
+
+def restore_cart(job):
+    """Add the job's lines back to the cart, unless the menu item is gone by now."""
+    lines = {line['menuitem_id']: line['quantity'] for line in job.lines}
+    existing = set(MenuItem.objects.filter(pk__in=lines).values_list('pk', flat=True))
+    lines = {pk: quantity for pk, quantity in lines.items() if pk in existing}
+    if not lines:
+        return
+    Cart.objects.bulk_create(
+        [Cart(user_id=job.user_id, menuitem_id=pk, quantity=0) for pk in lines], ignore_conflicts=True,
+    )
+    # on top of what the customer put in a new cart meanwhile
+    Cart.objects.filter(user_id=job.user_id, menuitem_id__in=lines).update(
+        quantity=F('quantity') + Case(*[When(menuitem_id=pk, then=Value(quantity)) for pk, quantity in lines.items()]),
+    )
+
+
+def run_checkout_jobs(batch_size=50):
+    """Claim a batch of due jobs and place their orders, returns (placed, failed attempts)."""
+    placed = failed = 0
+    for job in claim_checkout_jobs(batch_size):
+        if run_checkout_job(job):
+            placed += 1
+        else:
+            failed += 1
+    return placed, failed
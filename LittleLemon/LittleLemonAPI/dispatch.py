@@ -0,0 +1,206 @@
+import heapq
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count
+
+from .caching import bump_version, get_version
+from .events import record_order_events
+from .models import Order, OrderEvent
+
+
+CREW_GROUP = 'Delivery crew'
+# bumped when someone joins or leaves the crew, every process reloads
+CREW_VERSION_KEY = 'dispatch:crew:version'
+
+
+def invalidate_crew():
+    bump_version(CREW_VERSION_KEY)
+
+
+def open_loads():
+    """Open orders per active delivery crew member, members without any at 0."""
+    loads = dict.fromkeys(
+        User.objects.filter(groups__name=CREW_GROUP, is_active=True).values_list('pk', flat=True), 0
+    )
+    counts = (
+        Order.objects.filter(status=False, delivery_crew__groups__name=CREW_GROUP)
+        .values_list('delivery_crew').annotate(open=Count('id')).order_by()
+    )
+    for crew_id, count in counts:
+        if crew_id in loads:
+            loads[crew_id] = count
+    return loads
+
+
+class DispatchEngine:
+    """
+    The open-order load of every delivery crew member in a min-heap of
+    (load, crew id). A changed load pushes a new entry and leaves the old
+    one behind, entries that no longer match `loads` are dropped when they
+    reach the top, so assigning and releasing are O(log n).
+
+    Every process has its own engine and only sees its own assignments
+    between reloads, they happen when the crew changes and every
+    DISPATCH_REFRESH_SECONDS. dispatch_orders --rebalance evens out what
+    drifted meanwhile.
+    """
+
+    def __init__(self):
+        self.loads = {}
+        self.heap = []
+        self.lock = threading.Lock()
+        self.version = None
+        self.loaded_at = None
+
+    def load(self, loads, version=None):
+        with self.lock:
+            self.loads = dict(loads)
+            self.heap = [(load, crew_id) for crew_id, load in self.loads.items()]
+            heapq.heapify(self.heap)
+            self.version = version
+            self.loaded_at = time.monotonic()
+
+    def reload(self):
+        # the version first, a crew change while counting triggers another reload
+        version = get_version(CREW_VERSION_KEY)
+        self.load(open_loads(), version)
+
+    def reload_if_stale(self):
+        refresh = getattr(settings, 'DISPATCH_REFRESH_SECONDS', 60)
+        if (self.loaded_at is None or time.monotonic() - self.loaded_at > refresh
+                or self.version != get_version(CREW_VERSION_KEY)):
+            self.reload()
+
+    def push(self, crew_id, load):
+        self.loads[crew_id] = load
+        heapq.heappush(self.heap, (load, crew_id))
+        if len(self.heap) > 2 * len(self.loads) + 64:
+            # mostly stale entries, start over from the current loads
+            self.heap = [(load, crew_id) for crew_id, load in self.loads.items()]
+            heapq.heapify(self.heap)
+
+    def top(self):
+        # drops stale entries until the top one is current, the caller holds the lock
+        while self.heap:
+            load, crew_id = self.heap[0]
+            if self.loads.get(crew_id) == load:
+                return crew_id
+            heapq.heappop(self.heap)
+        return None
+
+    def assign(self):
+        """The least loaded crew member, counted as one order busier. None without crew."""
+        with self.lock:
+            crew_id = self.top()
+            if crew_id is not None:
+                load = self.loads[crew_id] + 1
+                self.loads[crew_id] = load
+                heapq.heapreplace(self.heap, (load, crew_id))
+            return crew_id
+
+    def add(self, crew_id, orders=1):
+        with self.lock:
+            if crew_id in self.loads:
+                self.push(crew_id, self.loads[crew_id] + orders)
+
+    def release(self, crew_id, orders=1):
+        with self.lock:
+            if crew_id in self.loads:
+                self.push(crew_id, max(0, self.loads[crew_id] - orders))
+
+    def order_changed(self, before, after):
+        """Move an order's load, `before` and `after` are its crew while open, else None."""
+        if before != after:
+            if before is not None:
+                self.release(before)
+            if after is not None:
+                self.add(after)
+
+
+dispatcher = DispatchEngine()
+
+
+def assign_crew():
+    """
+    The crew member for a new order, None when automatic dispatch is off or
+    there is no crew. The order counts at once, so checkouts running side by
+    side spread over the crew; a failed checkout gives it back with
+    release_crew(), any other rollback is evened out by the next reload.
+    """
+    if not getattr(settings, 'DISPATCH_AT_CHECKOUT', True):
+        return None
+    dispatcher.reload_if_stale()
+    return dispatcher.assign()
+
+
+def release_crew(crew_id):
+    """Give back a crew member assign_crew() counted for an order that was not placed."""
+    if crew_id is not None:
+        dispatcher.release(crew_id)
+
+
+def save_assignments(assignments, batch_size):
+    """Store (order id, crew id) pairs, one update per crew member instead of bulk_update's CASE per row."""
+    by_crew = defaultdict(list)
+    for order_id, crew_id in assignments:
+        by_crew[crew_id].append(order_id)
+    with transaction.atomic():
+        for crew_id, order_ids in by_crew.items():
+            for start in range(0, len(order_ids), batch_size):
+                Order.objects.filter(pk__in=order_ids[start:start + batch_size]).update(delivery_crew=crew_id)
+        # queryset updates send no signals, the feed is kept here, OrderQuerySet.update bumps the versions
+        record_order_events([
+            OrderEvent(order_id=order_id, status=False, delivery_crew_id=crew_id) for order_id, crew_id in assignments
+        ])
+
+
+def dispatch_unassigned(batch_size=1000):
+    """Give every open order without crew to the least loaded member, oldest first."""
+    dispatcher.reload()
+    assignments = []
+    unassigned = Order.objects.filter(status=False, delivery_crew__isnull=True).order_by('id')
+    for order_id in unassigned.values_list('id', flat=True).iterator(chunk_size=batch_size):
+        crew_id = dispatcher.assign()
+        if crew_id is None:
+            break
+        assignments.append((order_id, crew_id))
+    save_assignments(assignments, batch_size)
+    return len(assignments)
+
+
+def rebalance(batch_size=1000):
+    """
+    Move open orders off crew members above the average until loads differ
+    by one at most, and off users who left the crew. The most recent
+    orders move, older ones are likely on their way already.
+    """
+    version = get_version(CREW_VERSION_KEY)
+    loads = open_loads()
+    if not loads:
+        return 0
+    ceiling = -(-sum(loads.values()) // len(loads))
+    excess = {crew_id: load - ceiling for crew_id, load in loads.items() if load > ceiling}
+    crew = User.objects.filter(groups__name=CREW_GROUP, is_active=True)
+    moving = list(
+        Order.objects.filter(status=False, delivery_crew__isnull=False)
+        .exclude(delivery_crew__in=crew).values_list('id', flat=True)
+    )
+    if excess:
+        open_orders = (
+            Order.objects.filter(status=False, delivery_crew__in=list(excess))
+            .order_by('-id').values_list('id', 'delivery_crew')
+        )
+        for order_id, crew_id in open_orders.iterator(chunk_size=batch_size):
+            if excess[crew_id]:
+                excess[crew_id] -= 1
+                loads[crew_id] -= 1
+                moving.append(order_id)
+    dispatcher.load(loads, version)
+    assignments = [(order_id, dispatcher.assign()) for order_id in moving]
+    save_assignments(assignments, batch_size)
+    return len(assignments)
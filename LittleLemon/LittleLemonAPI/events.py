@@ -0,0 +1,134 @@
+import asyncio
+import datetime
+import random
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import OrderEvent
+
+
+EVENT_FIELDS = ['id', 'order', 'status', 'delivery_crew', 'deleted', 'created']
+prune_chance = 0.001
+
+
+def record_order_events(events):
+    """
+    Append OrderEvents to the feed once the transaction commits, now and then
+    dropping those past ORDER_EVENTS_RETENTION. Written along with the change,
+    an event could get an id below the feed's cursor before it is visible,
+    and a rolled back change would still be announced.
+    """
+    transaction.on_commit(lambda: write_order_events(events))
+
+
+def write_order_events(events):
+    OrderEvent.objects.bulk_create(events)
+    if random.random() < prune_chance:
+        retention = getattr(settings, 'ORDER_EVENTS_RETENTION', 24 * 60 * 60)
+        OrderEvent.objects.filter(created__lt=timezone.now() - datetime.timedelta(seconds=retention)).delete()
+
+
+def event_rows(queryset):
+    return queryset.order_by('id').values(*EVENT_FIELDS)
+
+
+class OrderFeed:
+    """
+    One thread per process polls OrderEvent for rows past the last one it
+    saw and hands them to the requests waiting on those orders, so the
+    database sees a poll every ORDER_EVENTS_POLL_SECONDS however many
+    clients wait. The thread starts from the newest event and stops once
+    nobody waits.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # order id: {future: the last event id its request has seen}
+        self.waiters = defaultdict(dict)
+        self.thread = None
+        self.started = None
+        self.last_id = None
+
+    async def subscribe(self, order_id, after):
+        """A future resolved with the next events of the order past `after`, the
+        last event the caller checked itself. Once this returns, the feed polls
+        every event the caller's own check that follows could miss."""
+        future = asyncio.get_running_loop().create_future()
+        with self.lock:
+            self.waiters[order_id][future] = after
+            if self.thread is None:
+                self.started = threading.Event()
+                self.thread = threading.Thread(target=self.run, args=(self.started,), name='order-feed', daemon=True)
+                self.thread.start()
+            started = self.started
+        if not started.is_set():
+            try:
+                await sync_to_async(started.wait, thread_sensitive=False)()
+            except BaseException:
+                self.unsubscribe(order_id, future)
+                raise
+        return future
+
+    def unsubscribe(self, order_id, future):
+        with self.lock:
+            waiting = self.waiters.get(order_id)
+            if waiting is not None:
+                waiting.pop(future, None)
+                if not waiting:
+                    del self.waiters[order_id]
+
+    def run(self, started):
+        try:
+            # not a client's cursor, which may be far behind the other clients' ones
+            self.last_id = OrderEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            started.set()
+            while True:
+                time.sleep(getattr(settings, 'ORDER_EVENTS_POLL_SECONDS', 0.5))
+                with self.lock:
+                    if not self.waiters:
+                        self.thread = None
+                        return
+                    last_id = self.last_id
+                rows = list(event_rows(OrderEvent.objects.filter(id__gt=last_id))[:1000])
+                if rows:
+                    self.publish(rows)
+        finally:
+            # subscribers never hang on a thread that failed to start
+            started.set()
+            connection.close()
+
+    def publish(self, rows):
+        by_order = defaultdict(list)
+        for row in rows:
+            by_order[row['order']].append(row)
+        with self.lock:
+            self.last_id = rows[-1]['id']
+            for order_id, events in by_order.items():
+                waiting = self.waiters.get(order_id, {})
+                for future, after in list(waiting.items()):
+                    # only what the request has not seen, it waits on otherwise
+                    unseen = [event for event in events if event['id'] > after]
+                    if not unseen:
+                        continue
+                    del waiting[future]
+                    try:
+                        future.get_loop().call_soon_threadsafe(resolve, future, unseen)
+                    except RuntimeError:
+                        # the request's event loop is gone
+                        pass
+                if not waiting:
+                    self.waiters.pop(order_id, None)
+
+
+def resolve(future, events):
+    if not future.done():
+        future.set_result(events)
+
+
+feed = OrderFeed()
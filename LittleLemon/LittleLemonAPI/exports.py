@@ -0,0 +1,54 @@
+import csv
+import tempfile
+
+from django.db.models import Prefetch
+
+from .models import OrderItem
+from .renderers import FastJSONRenderer
+from .serializers import OrderSerializer
+
+
+ORDER_COLUMNS = ['id', 'user', 'delivery_crew', 'status', 'total', 'date']
+ITEM_COLUMNS = ['menuitem', 'menuitem_name', 'quantity', 'unit_price', 'price']
+
+
+class Echo:
+    # csv.writer only needs write(), hand each row back instead of buffering
+    def write(self, value):
+        return value
+
+
+def iter_orders(queryset, chunk_size):
+    # server-side iteration, items are prefetched chunk by chunk
+    items = Prefetch('order_items', queryset=OrderItem.objects.select_related('menuitem'))
+    return queryset.order_by('pk').prefetch_related(items).iterator(chunk_size=chunk_size)
+
+
+def ndjson_lines(queryset, chunk_size=2000):
+    renderer = FastJSONRenderer()
+    for order in iter_orders(queryset, chunk_size):
+        yield renderer.render(OrderSerializer(order).data) + b'\n'
+
+
+def spool_lines(lines, max_size=4 * 1024 * 1024):
+    """The lines written out to a file, kept in memory up to max_size bytes and on disk past it."""
+    spooled = tempfile.SpooledTemporaryFile(max_size=max_size)
+    for line in lines:
+        spooled.write(line.encode() if isinstance(line, str) else line)
+    spooled.seek(0)
+    return spooled
+
+
+def csv_lines(queryset, chunk_size=2000):
+    """One row per order item, orders without items get a single row."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(ORDER_COLUMNS + ITEM_COLUMNS)
+    for order in iter_orders(queryset, chunk_size):
+        head = [order.pk, order.user_id, order.delivery_crew_id or '', order.status, order.total, order.date]
+        items = order.order_items.all()
+        if not items:
+            yield writer.writerow(head + [''] * len(ITEM_COLUMNS))
+        for item in items:
+            yield writer.writerow(head + [
+                item.menuitem_id, item.menuitem.title, item.quantity, item.unit_price, item.price,
+            ])
@@ -0,0 +1,106 @@
+from rest_framework import serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.response import Response
+
+
+def value_columns(serializer, prefix=''):
+    """
+    (output name, values() key, converter) for each readable field, the
+    converter being the field's own to_representation so output matches.
+    Method fields get no key, their value is filled in afterwards. A nested
+    serializer, e.g. an expanded relation, gets its own columns read from
+    the same joined row in place of a converter.
+    """
+    columns = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        source = prefix + field.source.replace('.', '__')
+        if isinstance(field, serializers.SerializerMethodField):
+            columns.append((name, None, None))
+        elif isinstance(field, serializers.Serializer):
+            columns.append((name, f'{source}__id', value_columns(field, f'{source}__')))
+        elif isinstance(field, (PrimaryKeyRelatedField, serializers.ReadOnlyField)):
+            columns.append((name, source, None))
+        else:
+            columns.append((name, source, field.to_representation))
+    return columns
+
+
+def value_keys(columns):
+    keys = set()
+    for _, key, convert in columns:
+        if key:
+            keys.add(key)
+        if isinstance(convert, list):
+            keys |= value_keys(convert)
+    return keys
+
+
+def row_keys(view, columns):
+    """The values() keys of a view's rows, with the ones its pagination reads back from them."""
+    keys = value_keys(columns) | {'id'}
+    keys.update(field.lstrip('-') for field in getattr(view.paginator, 'default_ordering', None) or ())
+    keys.update(getattr(view, 'ordering_fields', None) or ())
+    return keys
+
+
+def represent(columns, row):
+    item = {}
+    for name, key, convert in columns:
+        value = None if key is None else row[key]
+        if isinstance(convert, list):
+            item[name] = None if value is None else represent(convert, row)
+        else:
+            item[name] = value if convert is None or value is None else convert(value)
+    return item
+
+
+def nested_values(nested_class, foreign_key, rows):
+    """Columns and the one flat query for the nested rows of `rows`."""
+    columns = value_columns(nested_class())
+    keys = value_keys(columns) | {foreign_key}
+    queryset = nested_class.Meta.model.objects.filter(**{f'{foreign_key}__in': [row['id'] for row in rows]})
+    return columns, queryset.values(*keys)
+
+
+def attach_nested(data, rows, name, columns, foreign_key, nested_rows):
+    grouped = {row['id']: [] for row in rows}
+    for nested_row in nested_rows:
+        grouped[nested_row[foreign_key]].append(represent(columns, nested_row))
+    for item, row in zip(data, rows):
+        item[name] = grouped[row['id']]
+
+
+class ValuesListMixin:
+    """
+    Opt-in list path for read-only GETs: response dicts are built straight
+    from .values() rows, skipping model instances and serializer calls per
+    object. `values_nested` maps a list field to the serializer of its rows
+    and the foreign key pointing back, these come from one flat query.
+    """
+    values_serialization = False
+    values_nested = {}
+
+    def list(self, request, *args, **kwargs):
+        if not self.values_serialization:
+            return super().list(request, *args, **kwargs)
+
+        serializer = self.get_serializer()
+        columns = value_columns(serializer)
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None).values(*row_keys(self, columns))
+
+        page = self.paginate_queryset(queryset)
+        rows = list(queryset) if page is None else page
+        data = [represent(columns, row) for row in rows]
+        for name, (nested_class, foreign_key) in self.values_nested.items():
+            if name in serializer.fields:
+                self.add_nested_values(data, rows, name, nested_class, foreign_key)
+
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def add_nested_values(self, data, rows, name, nested_class, foreign_key):
+        columns, nested_rows = nested_values(nested_class, foreign_key, rows)
+        attach_nested(data, rows, name, columns, foreign_key, nested_rows)
@@ -0,0 +1,66 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from rest_framework import serializers
+
+from .caching import bump_catalog_version
+from .models import Category, MenuItem
+
+
+class MenuImportRowSerializer(serializers.Serializer):
+    title = serializers.CharField(max_length=255)
+    price = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=0)
+    featured = serializers.BooleanField(default=False)
+    category = serializers.SlugField()
+
+
+def validate_rows(rows):
+    valid, errors, seen = [], [], set()
+    for index, row in enumerate(rows):
+        serializer = MenuImportRowSerializer(data=row)
+        if not serializer.is_valid():
+            errors.append({'row': index, 'errors': serializer.errors})
+        elif serializer.validated_data['title'] in seen:
+            errors.append({'row': index, 'errors': {'title': ['Duplicate title in this import.']}})
+        else:
+            seen.add(serializer.validated_data['title'])
+            valid.append((index, serializer.validated_data))
+    return valid, errors
+
+
+def import_menu_items(rows, batch_size=500):
+    """
+    Create or update menu items by title. Nothing is written unless every
+    row is valid and its title and category each match at most one row. Returns created/updated counts and per-row errors.
+    """
+    valid, errors = validate_rows(rows)
+    # neither key is unique in the database, a key matching several rows cannot tell which one is meant
+    categories = defaultdict(list)
+    for slug, pk in Category.objects.filter(slug__in={data['category'] for _, data in valid}).values_list('slug', 'pk'):
+        categories[slug].append(pk)
+    existing = defaultdict(list)
+    for item in MenuItem.objects.filter(title__in=[data['title'] for _, data in valid]):
+        existing[item.title].append(item)
+    for index, data in valid:
+        if data['category'] not in categories:
+            errors.append({'row': index, 'errors': {'category': [f"Unknown category '{data['category']}'."]}})
+        elif len(categories[data['category']]) > 1:
+            errors.append({'row': index, 'errors': {'category': [f"More than one category has the slug '{data['category']}'."]}})
+        if len(existing[data['title']]) > 1:
+            errors.append({'row': index, 'errors': {'title': [f"More than one menu item has the title '{data['title']}'."]}})
+    if errors:
+        return {'created': 0, 'updated': 0, 'errors': sorted(errors, key=lambda error: error['row'])}
+
+    with transaction.atomic():
+        created, updated = [], []
+        for _, data in valid:
+            item, = existing[data['title']] or [MenuItem(title=data['title'])]
+            item.price, item.featured = data['price'], data['featured']
+            item.category_id = categories[data['category']][0]
+            (updated if item.pk else created).append(item)
+        MenuItem.objects.bulk_create(created, batch_size=batch_size)
+        MenuItem.objects.bulk_update(updated, ['price', 'featured', 'category'], batch_size=batch_size)
+    # bulk writes send no signals, retire the cached catalog once for all rows
+    bump_catalog_version()
+    return {'created': len(created), 'updated': len(updated), 'errors': []}
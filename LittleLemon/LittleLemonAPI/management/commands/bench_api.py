@@ -0,0 +1,260 @@
+import json
+import logging
+import queue
+import statistics
+import threading
+import time
+from contextlib import ExitStack
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.authtoken.models import Token
+
+from LittleLemonAPI import urls
+from LittleLemonAPI.models import Category, CheckoutJob, MenuItem, Order
+
+
+# (route as written in urls.py, method, who asks, body), path parameters are filled from the data
+ROUTES = [
+    ('menu-items', 'GET', 'customer', None),
+    ('menu-items/<int:pk>', 'GET', 'customer', None),
+    ('menu-items/search', 'GET', 'customer', None),
+    ('category', 'GET', 'customer', None),
+    ('category/<int:pk>', 'GET', 'customer', None),
+    ('groups/manager/users', 'GET', 'manager', None),
+    ('groups/manager/users/<int:pk>', 'GET', 'manager', None),
+    ('groups/delivery-crew/users', 'GET', 'manager', None),
+    ('groups/delivery-crew/users/<int:pk>', 'GET', 'manager', None),
+    ('cart/menu-items', 'GET', 'customer', None),
+    ('orders', 'GET', 'customer', None),
+    ('orders', 'GET', 'crew', None),
+    ('orders', 'GET', 'manager', None),
+    ('orders/export', 'GET', 'manager', None),
+    ('orders/<int:pk>', 'GET', 'customer', None),
+    ('orders/<int:pk>/events', 'GET', 'customer', None),
+    ('orders/jobs/<int:pk>', 'GET', 'customer', None),
+    ('reports/sales', 'GET', 'manager', None),
+    ('reports/top-sellers', 'GET', 'manager', None),
+    ('async/menu-items', 'GET', 'customer', None),
+    ('async/menu-items/<int:pk>', 'GET', 'customer', None),
+    ('async/category', 'GET', 'customer', None),
+    ('async/category/<int:pk>', 'GET', 'customer', None),
+    ('async/orders', 'GET', 'customer', None),
+    ('async/orders/<int:pk>', 'GET', 'customer', None),
+    # only with --writes, each request upserts the same row
+    ('cart/menu-items', 'POST', 'customer', 'cart'),
+    ('menu-items/bulk', 'POST', 'manager', 'menu'),
+]
+
+
+def search_term(title):
+    word = max(title.split(), key=len)
+    return word[:2] + word[3:] if len(word) > 4 else word
+
+
+class Command(BaseCommand):
+    help = (
+        'Hit every API route with concurrent clients and report p50/p95/p99 latency, throughput '
+        'and queries per request as JSON. Run seed_data first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8, help='client threads per route')
+        parser.add_argument('--requests', type=int, default=200, help='requests per route')
+        parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests per route')
+        parser.add_argument('--route', action='append', dest='routes', help='only this route, may be repeated')
+        parser.add_argument('--writes', action='store_true', help='also run the POST routes')
+        parser.add_argument('--keep-throttles', action='store_true', help='leave the rate limits on')
+        parser.add_argument('--output', help='write the JSON here instead of stdout')
+        parser.add_argument('--baseline', help='JSON of an earlier run to compare against')
+
+    def handle(self, *args, concurrency, requests, warmup, routes, writes, keep_throttles, output, baseline, **options):
+        routes = [
+            route for route in ROUTES
+            if (writes or route[1] == 'GET') and (not routes or route[0] in routes)
+        ]
+        if not routes:
+            raise CommandError('No route to run.')
+        missing = {str(pattern.pattern) for pattern in urls.urlpatterns} - {route[0] for route in ROUTES}
+        for pattern in sorted(missing):
+            self.stderr.write(self.style.WARNING(f'{pattern} is not benchmarked yet, add it to ROUTES.'))
+
+        self.fixtures = self.get_fixtures()
+        results = {}
+        with ExitStack() as stack:
+            # the test client always sends Host: testserver
+            stack.enter_context(override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']))
+            # errors are counted in the report, their tracebacks would bury the progress lines
+            request_logger = logging.getLogger('django.request')
+            stack.callback(setattr, request_logger, 'disabled', request_logger.disabled)
+            request_logger.disabled = True
+            if not keep_throttles:
+                for view_class in self.view_classes():
+                    stack.enter_context(mock.patch.object(view_class, 'throttle_classes', []))
+            for route in routes:
+                name = f'{route[1]} /api/{route[0]} as {route[2]}'
+                results[name] = self.run(route, concurrency, requests, warmup)
+                self.stderr.write(self.summary(name, results[name]))
+
+        report = {
+            'settings': {
+                'concurrency': concurrency, 'requests': requests, 'writes': writes,
+                'throttles': keep_throttles, 'database': connection.vendor,
+            },
+            'data': {
+                'menu_items': MenuItem.objects.count(), 'orders': Order.objects.count(),
+                'users': User.objects.count(),
+            },
+            'routes': results,
+        }
+        if baseline:
+            with open(baseline) as source:
+                self.compare(json.load(source)['routes'], results)
+
+        encoded = json.dumps(report, indent=2, sort_keys=True)
+        if output:
+            with open(output, 'w') as target:
+                target.write(encoded + '\n')
+        else:
+            self.stdout.write(encoded)
+
+    def view_classes(self):
+        for pattern in urls.urlpatterns:
+            view_class = getattr(pattern.callback, 'view_class', None)
+            if getattr(view_class, 'throttle_classes', None):
+                yield view_class
+
+    def get_fixtures(self):
+        manager = User.objects.filter(groups__name='Manager').first()
+        crew = User.objects.filter(groups__name='Delivery crew', delivery_crew__isnull=False).first()
+        order = Order.objects.order_by('-id').first()
+        item = MenuItem.objects.select_related('category').first()
+        if not (manager and crew and order and item):
+            raise CommandError('Needs a manager, a delivery crew member with orders and a menu item, run seed_data.')
+        users = {'manager': manager, 'crew': crew, 'customer': order.user}
+        job = CheckoutJob.objects.get_or_create(
+            user=order.user, order=order, defaults={'status': CheckoutJob.DONE, 'lines': []},
+        )[0]
+        return {
+            'headers': {
+                role: {'HTTP_AUTHORIZATION': f'Token {Token.objects.get_or_create(user=user)[0].key}'}
+                for role, user in users.items()
+            },
+            'pk': {
+                'menu-items': item.pk, 'category': Category.objects.first().pk, 'orders': order.pk,
+                'groups/manager/users': manager.pk, 'groups/delivery-crew/users': crew.pk,
+                'orders/jobs': job.pk,
+            },
+            # the longest word of a title with a letter missing, the typo tolerant path
+            'query': {
+                'menu-items/search': {'q': search_term(item.title)},
+                # only the check for missed events, a held request would time its wait
+                'orders/<int:pk>/events': {'after': 0, 'timeout': 0},
+            },
+            'cart': [{'menuitem': item.pk, 'quantity': 1}],
+            'menu': [{
+                'title': item.title, 'price': str(item.price),
+                'featured': item.featured, 'category': item.category.slug,
+            }],
+        }
+
+    def get_path(self, route):
+        path = f'/api/{route}'
+        if '<int:pk>' in route:
+            base = route.split('/<int:pk>')[0]
+            path = path.replace('<int:pk>', str(self.fixtures['pk'][base.removeprefix('async/')]))
+        if route in self.fixtures['query']:
+            path += f"?{urlencode(self.fixtures['query'][route])}"
+        return path
+
+    def run(self, route, concurrency, requests, warmup):
+        pattern, method, role, body = route
+        path = self.get_path(pattern)
+        extra = self.fixtures['headers'][role]
+        data = body and json.dumps(self.fixtures[body])
+
+        def call(client):
+            if method == 'GET':
+                return client.get(path, **extra)
+            return client.generic(method, path, data, content_type='application/json', **extra)
+
+        client = Client()
+        for _ in range(warmup):
+            call(client)
+
+        jobs = queue.SimpleQueue()
+        for _ in range(requests):
+            jobs.put(None)
+        samples = []
+
+        def worker(close=True):
+            # a server error is a sample like any other, e.g. a locked SQLite file under writes
+            client = Client(raise_request_exception=False)
+            try:
+                while True:
+                    try:
+                        jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    with CaptureQueriesContext(connection) as queries:
+                        start = time.perf_counter()
+                        response = call(client)
+                        elapsed = time.perf_counter() - start
+                    samples.append((elapsed, len(queries), response.status_code))
+            finally:
+                if close:
+                    connection.close()
+
+        start = time.perf_counter()
+        if concurrency == 1:
+            # on the calling thread, its connection may hold data no other thread can see
+            worker(close=False)
+        else:
+            threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        wall = time.perf_counter() - start
+
+        timings = sorted(sample[0] * 1000 for sample in samples)
+        percentiles = statistics.quantiles(timings, n=100, method='inclusive') if len(timings) > 1 else timings * 99
+        statuses = sorted({sample[2] for sample in samples})
+        return {
+            'path': path,
+            'requests': len(samples),
+            'errors': sum(sample[2] >= 400 for sample in samples),
+            'statuses': statuses,
+            'p50_ms': round(percentiles[49], 2),
+            'p95_ms': round(percentiles[94], 2),
+            'p99_ms': round(percentiles[98], 2),
+            'mean_ms': round(statistics.fmean(timings), 2),
+            'throughput_rps': round(len(samples) / wall, 1),
+            'queries_per_request': round(statistics.fmean(sample[1] for sample in samples), 2),
+        }
+
+    def summary(self, name, result):
+        return (
+            f"{name}: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, "
+            f"{result['throughput_rps']} req/s, {result['queries_per_request']} queries, "
+            f"status {result['statuses']}"
+        )
+
+    def compare(self, before, after):
+        for name, result in after.items():
+            if name not in before:
+                continue
+            old = before[name]
+            change = (result['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0
+            self.stderr.write(
+                f"{name}: p50 {old['p50_ms']} -> {result['p50_ms']} ms ({change:+.0f}%), "
+                f"p99 {old['p99_ms']} -> {result['p99_ms']} ms, "
+                f"queries {old['queries_per_request']} -> {result['queries_per_request']}"
+            )
@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, override_settings
+
+from rest_framework.authtoken.models import Token
+
+
+class Command(BaseCommand):
+    help = 'Throughput of the sync and async read endpoints under concurrent requests, through the ASGI handler.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=50, help='requests in flight at once')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--user', help='username whose token is used for the order endpoints')
+        parser.add_argument('--path', action='append', dest='paths', help='path under /api/, may be repeated')
+
+    def handle(self, *args, concurrency, requests, user, paths, **options):
+        headers = {}
+        if user:
+            try:
+                token, _ = Token.objects.get_or_create(user=User.objects.get(username=user))
+            except User.DoesNotExist:
+                raise CommandError(f'No user named {user}.')
+            # AsyncClient passes extra keys on as ASGI header names
+            headers['AUTHORIZATION'] = f'Token {token.key}'
+        paths = paths or ['menu-items', 'category', *(['orders'] if user else [])]
+
+        # the test client always sends Host: testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for path in paths:
+                self.bench(path, concurrency, requests, headers)
+
+    def bench(self, path, concurrency, requests, headers):
+        for label, url in [('sync', f'/api/{path}'), ('async', f'/api/async/{path}')]:
+            seconds, statuses = asyncio.run(self.run(url, concurrency, requests, headers))
+            if statuses != {200}:
+                raise CommandError(f'{url} answered {sorted(statuses)}.')
+            self.stdout.write(
+                f'{path} {label}: {requests / seconds:.0f} req/s, '
+                f'{seconds / requests * 1000:.2f} ms per request at concurrency {concurrency}'
+            )
+
+    async def run(self, url, concurrency, requests, headers):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        statuses = set()
+
+        async def fetch():
+            async with semaphore:
+                response = await client.get(url, **headers)
+                statuses.add(response.status_code)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(fetch() for _ in range(requests)))
+        return time.perf_counter() - start, statuses
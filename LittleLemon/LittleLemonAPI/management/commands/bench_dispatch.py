@@ -0,0 +1,81 @@
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+
+from LittleLemonAPI.dispatch import CREW_GROUP, DispatchEngine, open_loads, rebalance
+from LittleLemonAPI.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        'Time picking the least loaded delivery crew member with the dispatch heap against a '
+        'query per order, and a rebalance, over synthetic open orders.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--crew', type=int, default=200)
+        parser.add_argument('--orders', type=int, default=10000, help='open orders, spread unevenly over the crew')
+        parser.add_argument('--assign', type=int, default=10000, help='assignments timed on the heap')
+        parser.add_argument('--queries', type=int, default=200, help='assignments timed with a query each')
+
+    def handle(self, *args, crew, orders, assign, queries, **options):
+        # synthetic rows live in a transaction that is rolled back at the end
+        with transaction.atomic():
+            self.seed(crew, orders)
+
+            start = time.perf_counter()
+            loads = open_loads()
+            load_ms = (time.perf_counter() - start) * 1000
+
+            engine = DispatchEngine()
+            engine.load(loads)
+            start = time.perf_counter()
+            for _ in range(assign):
+                engine.assign()
+            heap_us = (time.perf_counter() - start) / assign * 1e6
+
+            start = time.perf_counter()
+            for _ in range(queries):
+                self.least_loaded()
+            query_us = (time.perf_counter() - start) / queries * 1e6
+
+            start = time.perf_counter()
+            moved = rebalance()
+            rebalance_ms = (time.perf_counter() - start) * 1000
+            loads = open_loads().values()
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'{crew} crew, {orders} open orders')
+        self.stdout.write(f'load from the database: {load_ms:.1f} ms')
+        self.stdout.write(
+            f'assign: heap {heap_us:.2f} us, query {query_us:.0f} us per order, {query_us / heap_us:.0f}x faster'
+        )
+        self.stdout.write(
+            f'rebalance: moved {moved} orders in {rebalance_ms:.0f} ms, '
+            f'now {min(loads)} to {max(loads)} open orders per crew member'
+        )
+
+    def seed(self, crew, orders):
+        customer = User.objects.create(username='bench-dispatch')
+        members = User.objects.bulk_create([User(username=f'bench-dispatch-crew-{i}') for i in range(crew)])
+        Group.objects.get_or_create(name=CREW_GROUP)[0].user_set.add(*members)
+        # a few members carry most of the orders, as when assigned by hand
+        weights = [1 / (rank + 1) for rank in range(crew)]
+        chosen = random.Random(0).choices(members, weights, k=orders)
+        Order.objects.bulk_create(
+            [Order(user=customer, delivery_crew=member, total=Decimal('10.00')) for member in chosen],
+            batch_size=1000,
+        )
+
+    def least_loaded(self):
+        # what a view would run without the engine
+        return (
+            User.objects.filter(groups__name=CREW_GROUP, is_active=True)
+            .annotate(open=Count('delivery_crew', filter=Q(delivery_crew__status=False)))
+            .order_by('open', 'id').values_list('id', flat=True).first()
+        )
@@ -0,0 +1,56 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_framework.renderers import JSONRenderer
+
+from LittleLemonAPI.renderers import FastJSONRenderer, orjson
+
+
+class Command(BaseCommand):
+    help = 'Encode throughput of the stdlib and orjson renderers on order list payloads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--items', type=int, default=5, help='order items per order')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, orders, items, repeat, **options):
+        payload = self.order_page(orders, items)
+        stdlib, fast = JSONRenderer(), FastJSONRenderer()
+        if stdlib.render(payload) != fast.render(payload):
+            raise CommandError('Renderers disagree on the payload.')
+        if orjson is None:
+            self.stdout.write(self.style.WARNING('orjson is not installed, FastJSONRenderer falls back to json.'))
+
+        size = len(stdlib.render(payload))
+        for label, renderer in [('json', stdlib), ('orjson', fast)]:
+            seconds = self.best(renderer, payload, repeat)
+            self.stdout.write(
+                f'{label}: {seconds * 1000:.2f} ms per page of {orders} orders, '
+                f'{size / seconds / 2 ** 20:.1f} MiB/s'
+            )
+
+    def order_page(self, orders, items):
+        # shaped like a GET /api/orders page, decimals already coerced to strings
+        date = datetime.date(2023, 3, 19)
+        return {
+            'count': orders, 'next': 'http://localhost:8000/api/orders?limit=10&offset=10', 'previous': None,
+            'results': [{
+                'id': order, 'user': order % 97 + 1, 'delivery_crew': None if order % 3 else 7,
+                'status': bool(order % 2), 'total': f'{items * 12.5:.2f}', 'date': date,
+                'order_items': [{
+                    'order': order, 'menuitem': item + 1, 'menuitem_name': f'Greek salad {item}',
+                    'quantity': 2, 'unit_price': '6.25', 'price': '12.50',
+                } for item in range(items)],
+            } for order in range(1, orders + 1)],
+        }
+
+    def best(self, renderer, payload, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            renderer.render(payload)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
@@ -0,0 +1,74 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from LittleLemonAPI.fastlists import represent, value_columns
+from LittleLemonAPI.models import Category, MenuItem, Order, OrderItem
+from LittleLemonAPI.serializers import MenuItemSerializer, OrderSerializer, OrderItemSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare ModelSerializer and values() list serialization, in ms per 1k rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, rows, repeat, **options):
+        # synthetic rows live in a transaction that is rolled back at the end
+        with transaction.atomic():
+            orders = self.seed(rows)
+            self.report('menu items', rows, repeat,
+                        lambda: MenuItemSerializer(MenuItem.objects.all(), many=True).data,
+                        lambda: self.values_menu())
+            self.report('orders', rows, repeat,
+                        lambda: OrderSerializer(orders.with_items(), many=True).data,
+                        lambda: self.values_orders(orders))
+            transaction.set_rollback(True)
+
+    def seed(self, rows):
+        user = User.objects.create(username='bench-serialization')
+        category = Category.objects.create(slug='bench', title='Bench')
+        menu = MenuItem.objects.bulk_create([
+            MenuItem(title=f'Item {i}', price=Decimal('1.25') + i % 50, featured=i % 7 == 0, category=category)
+            for i in range(rows)
+        ])
+        orders = Order.objects.bulk_create([Order(user=user, total=Decimal('12.50')) for _ in range(rows)])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menuitem=menu[(i + j) % rows], quantity=2, unit_price=Decimal('6.25'), price=Decimal('12.50'))
+            for i, order in enumerate(orders) for j in range(3)
+        ])
+        return Order.objects.filter(user=user)
+
+    def values_menu(self):
+        columns = value_columns(MenuItemSerializer())
+        return [represent(columns, row) for row in MenuItem.objects.values(*{key for _, key, _ in columns})]
+
+    def values_orders(self, orders):
+        columns = value_columns(OrderSerializer())
+        item_columns = value_columns(OrderItemSerializer())
+        data = {row['id']: represent(columns, row) for row in orders.values(*{key for _, key, _ in columns if key})}
+        for order in data.values():
+            order['order_items'] = []
+        for row in OrderItem.objects.filter(order__in=orders).values(*{key for _, key, _ in item_columns}):
+            data[row['order']]['order_items'].append(represent(item_columns, row))
+        return list(data.values())
+
+    def report(self, label, rows, repeat, serializer_path, values_path):
+        slow, fast = self.best(serializer_path, repeat), self.best(values_path, repeat)
+        per_k = 1000 / rows
+        self.stdout.write(
+            f'{label}: serializer {slow * per_k * 1000:.1f} ms/1k, values {fast * per_k * 1000:.1f} ms/1k, '
+            f'{slow / fast:.1f}x faster'
+        )
+
+    def best(self, path, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            path()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.dispatch import dispatch_unassigned, open_loads, rebalance
+
+
+class Command(BaseCommand):
+    help = (
+        'Give open orders without delivery crew to the least loaded crew members, '
+        'and with --rebalance even out the open orders of the crew. Run it periodically.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebalance', action='store_true', help='also move orders off busy crew members')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        assigned = dispatch_unassigned(batch_size)
+        moved = rebalance(batch_size) if options['rebalance'] else 0
+        loads = open_loads().values()
+        spread = f', {min(loads)} to {max(loads)} open orders per crew member' if loads else ', no delivery crew'
+        self.stdout.write(self.style.SUCCESS(f'Assigned {assigned} orders, moved {moved}{spread}.'))
@@ -0,0 +1,23 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LittleLemonAPI.importers import import_menu_items
+
+
+class Command(BaseCommand):
+    help = 'Create or update menu items from a JSON array or a CSV file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='.json or .csv file with title, price, featured and category (slug)')
+
+    def handle(self, *args, path, **options):
+        with open(path, newline='', encoding='utf-8') as source:
+            rows = list(csv.DictReader(source)) if path.endswith('.csv') else json.load(source)
+        result = import_menu_items(rows)
+        if result['errors']:
+            for error in result['errors']:
+                self.stderr.write(f"row {error['row']}: {json.dumps(error['errors'])}")
+            raise CommandError(f"{len(result['errors'])} invalid rows, nothing imported.")
+        self.stdout.write(self.style.SUCCESS(f"Created {result['created']}, updated {result['updated']} menu items."))
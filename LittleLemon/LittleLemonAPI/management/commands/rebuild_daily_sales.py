@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from LittleLemonAPI.models import DailySales, OrderItem
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the DailySales rollup from the order history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    @transaction.atomic
+    def handle(self, *args, batch_size, **options):
+        rows = (
+            OrderItem.objects.values('order__date', 'menuitem')
+            .annotate(orders=Count('order', distinct=True), quantity=Sum('quantity'), revenue=Sum('price'))
+            .order_by()
+        )
+        DailySales.objects.all().delete()
+        batch, created = [], 0
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(DailySales(
+                date=row['order__date'], menuitem_id=row['menuitem'],
+                orders=row['orders'], quantity=row['quantity'], revenue=row['revenue'],
+            ))
+            if len(batch) == batch_size:
+                created += len(DailySales.objects.bulk_create(batch))
+                batch = []
+        created += len(DailySales.objects.bulk_create(batch))
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {created} daily sales rows.'))
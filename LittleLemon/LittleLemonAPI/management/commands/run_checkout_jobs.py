@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from LittleLemonAPI.checkout import run_checkout_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Place the orders of queued async checkouts, a batch at a time. Runs until stopped, '
+        'several workers can share the queue. --once drains what is due and exits.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--once', action='store_true', help='exit once no job is due')
+        parser.add_argument('--poll', type=float, default=1.0, help='seconds to wait when the queue is empty')
+
+    def handle(self, *args, batch_size, once, poll, **options):
+        placed = failed = 0
+        while True:
+            close_old_connections()
+            batch_placed, batch_failed = run_checkout_jobs(batch_size)
+            placed += batch_placed
+            failed += batch_failed
+            if batch_placed + batch_failed == 0:
+                if once:
+                    break
+                time.sleep(poll)
+        self.stdout.write(self.style.SUCCESS(f'Placed {placed} orders, {failed} attempts failed.'))
@@ -0,0 +1,142 @@
+import datetime
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, Group
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from LittleLemonAPI.caching import ORDERS_VERSION_KEY, bump_catalog_version, bump_version
+from LittleLemonAPI.models import Category, MenuItem, Order, OrderItem
+
+
+# titles made of real words, so menu search meets realistic trigram frequencies
+TITLE_WORDS = [
+    ['Grilled', 'Roasted', 'Spicy', 'Smoky', 'Crispy', 'Braised', 'Fresh', 'Baked', 'Lemony', 'Stuffed'],
+    ['Lamb', 'Chicken', 'Halloumi', 'Octopus', 'Eggplant', 'Feta', 'Shrimp', 'Zucchini', 'Lentil', 'Sardine',
+     'Chickpea', 'Beef', 'Salmon', 'Spinach', 'Mushroom'],
+    ['Souvlaki', 'Moussaka', 'Gyro', 'Salad', 'Pita', 'Kebab', 'Risotto', 'Pie', 'Stew', 'Flatbread',
+     'Bruschetta', 'Tagine', 'Skewers', 'Soup', 'Baklava'],
+]
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with synthetic categories, menu items, users in every role and orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--menu-items', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--orders', type=int, default=2000000)
+        parser.add_argument('--max-items', type=int, default=5, help='most order items per order')
+        parser.add_argument('--days', type=int, default=365, help='orders are spread over this many past days')
+        parser.add_argument('--scale', type=float, default=1.0, help='multiplies every count above')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='seed', help='username and slug prefix of the generated rows')
+        parser.add_argument('--password', default='littlelemon', help='password of every generated user')
+        parser.add_argument('--seed', type=int, default=0, help='random seed, the same seed gives the same data')
+
+    def handle(self, *args, scale, batch_size, prefix, **options):
+        counts = {
+            name: max(1, int(options[name] * scale))
+            for name in ('categories', 'menu_items', 'users', 'orders')
+        }
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f'Users named {prefix}-* exist already, pick another --prefix.')
+        self.random = random.Random(options['seed'])
+        self.batch_size = batch_size
+
+        menu = self.seed_menu(prefix, counts['categories'], counts['menu_items'])
+        customers, crew = self.seed_users(prefix, counts['users'], options['password'])
+        self.seed_orders(counts['orders'], customers, crew, menu, options['max_items'], options['days'])
+
+        # bulk_create sends no signals, the rollup and cached versions are refreshed here
+        call_command('rebuild_daily_sales', batch_size=batch_size, stdout=self.stdout)
+        bump_catalog_version()
+        bump_version(ORDERS_VERSION_KEY)
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded {categories} categories, {menu_items} menu items, {users} users and {orders} orders.'.format(**counts)
+        ))
+
+    def batches(self, size):
+        for start in range(0, size, self.batch_size):
+            yield range(start, min(start + self.batch_size, size))
+
+    @transaction.atomic
+    def seed_menu(self, prefix, categories, menu_items):
+        categories = Category.objects.bulk_create([
+            Category(slug=f'{prefix}-{i}', title=f'Category {i}') for i in range(categories)
+        ])
+        menu = []
+        for batch in self.batches(menu_items):
+            menu += MenuItem.objects.bulk_create([
+                MenuItem(
+                    title=' '.join([*(self.random.choice(words) for words in TITLE_WORDS), str(i)]),
+                    price=Decimal(self.random.randrange(150, 4000)) / 100,
+                    featured=self.random.random() < 0.05,
+                    category=self.random.choice(categories),
+                ) for i in batch
+            ])
+        self.stdout.write(f'{len(categories)} categories, {len(menu)} menu items')
+        return [(item.pk, item.price) for item in menu]
+
+    @transaction.atomic
+    def seed_users(self, prefix, users, password):
+        # one hash for everyone, hashing per user would take most of the run
+        password = make_password(password)
+        managers, _ = Group.objects.get_or_create(name='Manager')
+        delivery, _ = Group.objects.get_or_create(name='Delivery crew')
+        Membership = User.groups.through
+
+        # 0.1% managers and 2% delivery crew, at least one of each
+        staff = {'managers': max(1, users // 1000), 'crew': max(1, users // 50)}
+        customers, crew = [], []
+        for batch in self.batches(users):
+            created = User.objects.bulk_create([
+                User(username=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com', password=password)
+                for i in batch
+            ])
+            memberships = []
+            for i, user in zip(batch, created):
+                if i < staff['managers']:
+                    memberships.append(Membership(user_id=user.pk, group_id=managers.pk))
+                elif i < staff['managers'] + staff['crew']:
+                    memberships.append(Membership(user_id=user.pk, group_id=delivery.pk))
+                    crew.append(user.pk)
+                else:
+                    customers.append(user.pk)
+            Membership.objects.bulk_create(memberships)
+        self.stdout.write(f'{users} users, {len(crew)} delivery crew, {len(customers)} customers')
+        return customers or crew, crew
+
+    def seed_orders(self, orders, customers, crew, menu, max_items, days):
+        today = datetime.date.today()
+        max_items = min(max_items, len(menu))
+        for number, batch in enumerate(self.batches(orders)):
+            lines = [self.random.sample(menu, self.random.randint(1, max_items)) for _ in batch]
+            quantities = [[self.random.randint(1, 3) for _ in order_lines] for order_lines in lines]
+            with transaction.atomic():
+                created = Order.objects.bulk_create([
+                    Order(
+                        user_id=self.random.choice(customers),
+                        delivery_crew_id=self.random.choice(crew) if crew and self.random.random() < 0.7 else None,
+                        status=self.random.random() < 0.6,
+                        total=sum(price * quantity for (_, price), quantity in zip(order_lines, order_quantities)),
+                    ) for order_lines, order_quantities in zip(lines, quantities)
+                ])
+                OrderItem.objects.bulk_create([
+                    OrderItem(
+                        order_id=order.pk, menuitem_id=menuitem_id,
+                        quantity=quantity, unit_price=price, price=price * quantity,
+                    )
+                    for order, order_lines, order_quantities in zip(created, lines, quantities)
+                    for (menuitem_id, price), quantity in zip(order_lines, order_quantities)
+                ])
+                # date is auto_now_add, a batch is moved into the past with an update
+                date = today - datetime.timedelta(days=self.random.randrange(days))
+                Order.objects.filter(pk__in=[order.pk for order in created]).update(date=date)
+            if number % 20 == 19:
+                self.stdout.write(f'{batch.stop} of {orders} orders')
+        self.stdout.write(f'{orders} orders')
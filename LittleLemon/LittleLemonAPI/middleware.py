@@ -0,0 +1,157 @@
+import json
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+# the timings of the request being handled, copied into sync_to_async threads with the context
+current_timings = ContextVar('current_timings', default=None)
+
+
+class RequestTimings:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.view_start = self.render_start = self.render_end = None
+        self.queries = []
+        self.idle = 0.0
+
+    def mark_render_end(self, response):
+        self.render_end = time.perf_counter()
+
+    def summary(self):
+        end = time.perf_counter()
+        view_end = self.render_start or end
+        by_sql = defaultdict(list)
+        for sql, seconds in self.queries:
+            by_sql[sql].append(seconds)
+        return {
+            'total_ms': (end - self.start) * 1000,
+            'view_ms': (view_end - self.view_start) * 1000 if self.view_start else 0,
+            'render_ms': (self.render_end - self.render_start) * 1000 if self.render_end else 0,
+            'sql_ms': sum(seconds for _, seconds in self.queries) * 1000,
+            'idle_ms': self.idle * 1000,
+            'queries': len(self.queries),
+            # the same statement run again, usually a loop issuing one query per object
+            'duplicate_queries': sum(len(runs) - 1 for runs in by_sql.values()),
+            'by_sql': by_sql,
+        }
+
+
+def record_sql(execute, sql, params, many, context):
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries.append((sql, time.perf_counter() - start))
+
+
+@contextmanager
+def idle():
+    """Time a view waits on purpose, e.g. a long poll, is reported apart and does not make it slow."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = current_timings.get()
+        if timings is not None:
+            timings.idle += time.perf_counter() - start
+
+
+def install_sql_recorder(connection):
+    # first in the list, execute_wrapper() blocks pop from the end
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_sql)
+
+
+class RequestTimingMiddleware:
+    """
+    Time SQL, the view and rendering for every request, report them in a
+    Server-Timing header and log requests slower than SLOW_REQUEST_MS with
+    their most expensive statements. Queries run by the async ORM are
+    counted too, the recorder finds the request through a context variable.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        for connection in connections.all(initialized_only=True):
+            install_sql_recorder(connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = current_timings.get()
+        if timings is not None:
+            timings.view_start = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        timings = current_timings.get()
+        if timings is not None:
+            timings.render_start = time.perf_counter()
+            response.add_post_render_callback(timings.mark_render_end)
+        return response
+
+    def finish(self, request, response, timings):
+        summary = timings.summary()
+        metrics = [
+            f'sql;dur={summary["sql_ms"]:.1f};desc="{summary["queries"]} queries '
+            f'({summary["duplicate_queries"]} duplicate)"',
+            f'view;dur={summary["view_ms"]:.1f}',
+            f'render;dur={summary["render_ms"]:.1f}',
+            f'total;dur={summary["total_ms"]:.1f}',
+        ]
+        if timings.idle:
+            metrics.append(f'idle;dur={summary["idle_ms"]:.1f}')
+        response['Server-Timing'] = ', '.join(metrics)
+        if summary['total_ms'] - summary['idle_ms'] >= getattr(settings, 'SLOW_REQUEST_MS', 500):
+            self.log_slow_request(request, response, summary)
+        return response
+
+    def log_slow_request(self, request, response, summary):
+        by_sql = summary.pop('by_sql')
+        top = sorted(by_sql.items(), key=lambda item: sum(item[1]), reverse=True)
+        record = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            **{name: round(value, 2) for name, value in summary.items()},
+            'top_sql': [
+                {'sql': sql[:500], 'count': len(runs), 'ms': round(sum(runs) * 1000, 2)}
+                for sql, runs in top[:getattr(settings, 'SLOW_REQUEST_TOP_SQL', 5)]
+            ],
+        }
+        logger.warning('slow request %s', json.dumps(record), extra={'timing': record})
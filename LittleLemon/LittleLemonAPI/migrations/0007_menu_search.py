@@ -0,0 +1,38 @@
+from django.db import OperationalError, migrations
+
+
+def create_search_table(apps, schema_editor):
+    # SQLite 3.34+ with FTS5, elsewhere search falls back to prefix matching on the titles
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE "LittleLemonAPI_menusearch" USING fts5(title, category, tokenize="trigram")'
+        )
+    except OperationalError:
+        return
+    schema_editor.execute(
+        'INSERT INTO "LittleLemonAPI_menusearch" (rowid, title, category) '
+        'SELECT item.id, item.title, category.title FROM "LittleLemonAPI_menuitem" item '
+        'JOIN "LittleLemonAPI_category" category ON category.id = item.category_id'
+    )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for trigger in ['menusearch_insert', 'menusearch_update', 'menusearch_delete', 'menusearch_category_update']:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    schema_editor.execute('DROP TABLE IF EXISTS "LittleLemonAPI_menusearch"')
+
+
+class Migration(migrations.Migration):
+    # the triggers keeping the table in sync are installed after every migrate, see signals.py
+
+    dependencies = [
+        ('LittleLemonAPI', '0006_order_menuitem_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0009_checkoutjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='date',
+            field=models.DateField(auto_now_add=True, db_index=True),
+        ),
+    ]
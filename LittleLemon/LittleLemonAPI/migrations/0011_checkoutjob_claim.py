@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0010_order_date_auto_now_add'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkoutjob',
+            name='claim',
+            field=models.UUIDField(db_index=True, editable=False, null=True),
+        ),
+    ]
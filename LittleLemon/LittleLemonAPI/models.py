@@ -1,5 +1,9 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .caching import bump_order_version
 # Create your models here.
 
 class Category(models.Model):
@@ -13,15 +17,48 @@ class MenuItem(models.Model):
     title = models.CharField(max_length=255, db_index=True)
     price = models.DecimalField(max_digits=6, decimal_places=2, db_index=True)
     featured = models.BooleanField(db_index=True)
-    category = models.ForeignKey(Category, on_delete=models.PROTECT)
+    # menuitem_category_price_idx leads with the category, it serves the foreign key too
+    category = models.ForeignKey(Category, on_delete=models.PROTECT, db_index=False)
+
+    class Meta:
+        indexes = [
+            # menu filtered by category, ordered by price
+            models.Index(fields=['category', 'price'], name='menuitem_category_price_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+class CartQuerySet(models.QuerySet):
+    def with_prices(self):
+        # unit and line prices computed by the database, the menu item title joined
+        return self.annotate(
+            menuitem_title=models.F('menuitem__title'),
+            line_unit_price=models.F('menuitem__price'),
+            line_price=models.ExpressionWrapper(
+                models.F('quantity') * models.F('menuitem__price'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+
+    def summary(self):
+        """Lines, items and subtotal of the cart in one aggregate."""
+        return self.order_by().aggregate(
+            lines=models.Count('id'),
+            item_count=Coalesce(models.Sum('quantity'), 0),
+            subtotal=Coalesce(
+                models.Sum(models.F('quantity') * models.F('menuitem__price')),
+                models.Value(0),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+
+
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
     quantity = models.SmallIntegerField()
+    objects = CartQuerySet.as_manager()
     # unit_price = models.DecimalField(max_digits=6, decimal_places=2)
     # price = models.DecimalField(max_digits=6, decimal_places=2)
 
@@ -41,12 +78,53 @@ class Cart(models.Model):
 
 
 
+class OrderQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # queryset updates send no signals, the versions of the users involved are bumped here
+        users = {user_id for pair in self.values_list('user', 'delivery_crew').distinct() for user_id in pair}
+        rows = super().update(**kwargs)
+        crew = kwargs.get('delivery_crew', kwargs.get('delivery_crew_id'))
+        bump_order_version(users | {getattr(crew, 'pk', crew)})
+        return rows
+
+    def with_items(self):
+        # users joined, items and their menu items in one extra query
+        return self.select_related('user', 'delivery_crew').prefetch_related(
+            models.Prefetch('order_items', queryset=OrderItem.objects.select_related('menuitem'))
+        )
+
+
 class Order(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    delivery_crew = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='delivery_crew', null=True)
-    status = models.BooleanField(db_index=True, default=0)
+    # the user, crew and status lookups are served by the composite indexes leading with them
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    delivery_crew = models.ForeignKey(
+        User, on_delete=models.SET_NULL, related_name='delivery_crew', null=True, db_index=False,
+    )
+    status = models.BooleanField(default=0)
     total = models.DecimalField(max_digits=6, decimal_places=2, default=0)
-    date = models.DateField(auto_now=True , db_index=True)
+    date = models.DateField(auto_now_add=True, db_index=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        order = super().from_db(db, field_names, values)
+        # the crew as loaded, a reassignment changes the order lists of both crew members
+        order.loaded_crew_id = order.__dict__.get('delivery_crew_id')
+        return order
+
+    class Meta:
+        # OrderView lists the orders of a customer or a delivery crew member, or
+        # every order by status for managers, then sorts by date or total. The
+        # trailing id is the pagination tiebreaker, so pages need no sort step.
+        indexes = [
+            models.Index(fields=['user', 'date', 'id'], name='order_user_date_idx'),
+            models.Index(fields=['user', 'total', 'id'], name='order_user_total_idx'),
+            models.Index(fields=['delivery_crew', 'date', 'id'], name='order_crew_date_idx'),
+            models.Index(fields=['delivery_crew', 'total', 'id'], name='order_crew_total_idx'),
+            models.Index(fields=['status', 'date', 'id'], name='order_status_date_idx'),
+            models.Index(fields=['total', 'id'], name='order_total_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -57,4 +135,59 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=6, decimal_places=2)
 
     class Meta:
-        unique_together = ['order', 'menuitem']
\ No newline at end of file
+        unique_together = ['order', 'menuitem']
+
+
+class DailySales(models.Model):
+    # rollup kept up to date by checkout, rebuilt with rebuild_daily_sales
+    date = models.DateField(db_index=True)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    orders = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ['date', 'menuitem']
+
+
+class OrderEvent(models.Model):
+    # change feed of orders, the id is the cursor clients resume from; kept
+    # for deleted orders and users too, so no foreign key constraints
+    order = models.ForeignKey(
+        Order, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name='+',
+    )
+    status = models.BooleanField(null=True)
+    delivery_crew = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, null=True, related_name='+',
+    )
+    deleted = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'id'], name='orderevent_order_idx'),
+        ]
+
+
+class CheckoutJob(models.Model):
+    # a cart moved out of the way by an async checkout, run_checkout_jobs places the order
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    lines = models.JSONField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    # stamped by the claiming worker, its writes only land while the stamp is its own
+    claim = models.UUIDField(null=True, editable=False, db_index=True)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, related_name='+')
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # workers take due jobs in order
+            models.Index(fields=['status', 'run_after', 'id'], name='checkoutjob_queue_idx'),
+        ]
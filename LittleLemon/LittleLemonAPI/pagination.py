@@ -0,0 +1,198 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, LimitOffsetPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def invert(ordering):
+    return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+
+def keyset_filter(ordering, position):
+    # (a, b, id) > (x, y, z) spelled out for columns that may sort either way
+    condition = Q()
+    for index, field in enumerate(ordering):
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        equal = {name.lstrip('-'): value for name, value in zip(ordering[:index], position[:index])}
+        condition |= Q(**equal, **{f'{field.lstrip("-")}__{lookup}': position[index]})
+    return condition
+
+
+class KeysetPagination(BasePagination):
+    """
+    A cursor based style that seeks past the last row instead of counting
+    and skipping rows, so every page costs the same. For example:
+
+    http://api.example.org/orders/?cursor=&ordering=-total
+    http://api.example.org/orders/?cursor=WyItdG90YWwiLC...
+
+    The requested ordering gets an id tiebreaker, which keeps pages stable
+    when many rows share a total or a date.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    default_ordering = ['-date']
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.get_page_queryset(queryset, request, view)))
+
+    def get_page_queryset(self, queryset, request, view=None):
+        # one row more than the page tells whether there is a page after it
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.position, self.reverse = self.decode_cursor(request, queryset)
+
+        ordering = invert(self.ordering) if self.reverse else self.ordering
+        if self.position is not None:
+            queryset = queryset.filter(keyset_filter(ordering, self.position))
+        return queryset.order_by(*ordering)[:self.page_size + 1]
+
+    def set_page(self, results):
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        if view is not None and OrderingFilter in getattr(view, 'filter_backends', []):
+            ordering = OrderingFilter().get_ordering(request, queryset, view)
+        ordering = [field for field in ordering or self.default_ordering if field.lstrip('-') not in ('id', 'pk')]
+        tiebreaker = '-id' if ordering and ordering[-1].startswith('-') else 'id'
+        return [*ordering, tiebreaker]
+
+    def get_position(self, instance):
+        fields = [field.lstrip('-') for field in self.ordering]
+        if isinstance(instance, dict):
+            return [instance[field] for field in fields]
+        return [getattr(instance, field) for field in fields]
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+    def encode_cursor(self, position, reverse):
+        # the ordering travels along so a cursor is never applied to another one
+        token = json.dumps([self.ordering, position, reverse], cls=DjangoJSONEncoder)
+        encoded = urlsafe_b64encode(token.encode()).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            ordering, position, reverse = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            if ordering != self.ordering or len(position) != len(ordering) or None in position:
+                raise ValueError
+            # the values go into the page filter, a tampered one must not get that far
+            fields = [queryset.model._meta.get_field(field.lstrip('-')) for field in ordering]
+            position = [field.to_python(value) for field, value in zip(fields, position)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, bool(reverse)
+
+
+class OrderPagination(KeysetPagination):
+    """Keyset pages once a client sends `cursor`, limit/offset pages otherwise."""
+    offset_pagination_class = LimitOffsetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        paginator = self.get_active_paginator(request)
+        if paginator is self:
+            return super().paginate_queryset(queryset, request, view)
+        return paginator.paginate_queryset(queryset, request, view)
+
+    def get_active_paginator(self, request):
+        self.offset_paginator = None
+        if self.cursor_query_param in request.query_params:
+            return self
+        self.offset_paginator = self.offset_pagination_class()
+        return self.offset_paginator
+
+    def get_paginated_response(self, data):
+        if self.offset_paginator is not None:
+            return self.offset_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class CartPagination(LimitOffsetPagination):
+    """Limit/offset pages of cart lines along with the whole cart's item count and subtotal."""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # the line count comes from the same aggregate as the totals
+        self.summary = queryset.summary()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count(self, queryset):
+        return self.summary['lines']
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('item_count', self.summary['item_count']),
+            ('subtotal', self.summary['subtotal']),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
+async def apaginate_queryset(paginator, queryset, request, view=None):
+    """paginate_queryset() for async views, running the queries on the async ORM."""
+    if isinstance(paginator, OrderPagination):
+        paginator = paginator.get_active_paginator(request)
+    if isinstance(paginator, KeysetPagination):
+        page = paginator.get_page_queryset(queryset, request, view)
+        return paginator.set_page([row async for row in page])
+
+    paginator.limit = paginator.get_limit(request)
+    paginator.count = await queryset.acount()
+    paginator.offset = paginator.get_offset(request)
+    paginator.request = request
+    if paginator.count == 0 or paginator.offset > paginator.count:
+        return []
+    return [row async for row in queryset[paginator.offset:paginator.offset + paginator.limit]]
@@ -1,7 +1,15 @@
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+
 from rest_framework.permissions import DjangoModelPermissions
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 
 
+ROLE_CACHE_TIMEOUT = 60 * 5
+
+
 class IsAdminUserOrManager(BasePermission):
     def has_permission(self, request, view):
         return bool(request.user and request.user.is_authenticated and (
@@ -34,8 +42,38 @@ class IsOrderOwner(BasePermission):
         return False
 
 
+def order_users(row):
+    """Stand-in for an order row with `user` and `delivery_crew` ids, the order permissions only compare users."""
+    return SimpleNamespace(
+        user=User(pk=row['user']),
+        delivery_crew=row['delivery_crew'] and User(pk=row['delivery_crew']),
+    )
+
+
+def role_cache_key(user_id):
+    return f'roles:{user_id}'
+
+
+def get_roles(user):
+    # group names are kept on the user for the request and shared through the cache
+    if not user or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_roles', None)
+    if roles is None:
+        roles = caches['versions'].get(role_cache_key(user.pk))
+        if roles is None:
+            roles = frozenset(user.groups.values_list('name', flat=True))
+            caches['versions'].set(role_cache_key(user.pk), roles, ROLE_CACHE_TIMEOUT)
+        user._roles = roles
+    return roles
+
+
+def invalidate_roles(*user_ids):
+    caches['versions'].delete_many([role_cache_key(user_id) for user_id in user_ids])
+
+
 def IsManager(user):
-    return bool(user.groups.filter(name='Manager').exists())
+    return 'Manager' in get_roles(user)
 
 def IsDeliveryCrew(user):
-    return bool(user.groups.filter(name='Delivery crew').exists())
\ No newline at end of file
+    return 'Delivery crew' in get_roles(user)
@@ -0,0 +1,99 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.deprecation import MiddlewareMixin
+
+from rest_framework.permissions import SAFE_METHODS
+
+
+# set while a view that may read stale rows runs, copied into sync_to_async threads
+replica_reads = ContextVar('replica_reads', default=False)
+
+
+def pin_key(name):
+    return f'replica:pinned:{name}'
+
+
+def pin_to_primary(*names):
+    """Keep reads of these users or scopes on the primary until replicas caught up."""
+    timeout = getattr(settings, 'REPLICA_LAG_SECONDS', 5)
+    if getattr(settings, 'DATABASE_REPLICAS', None) and timeout:
+        caches['versions'].set_many({pin_key(name): True for name in names}, timeout)
+
+
+def is_pinned(*names):
+    return bool(caches['versions'].get_many([pin_key(name) for name in names]))
+
+
+def replica_allowed(user, scope=None):
+    if not getattr(settings, 'DATABASE_REPLICAS', None):
+        return False
+    names = [scope] if scope else []
+    if user is not None and user.is_authenticated:
+        names.append(f'user:{user.pk}')
+    return not is_pinned(*names)
+
+
+class ReplicaRouter:
+    """
+    Reads of this app's models go to a random alias in DATABASE_REPLICAS
+    while replica_reads is set, everything else to the primary. Users,
+    groups and tokens are never read from a replica, roles and logins are
+    checked against current data.
+    """
+
+    def db_for_read(self, model, **hints):
+        if replica_reads.get() and model._meta.app_label == 'LittleLemonAPI':
+            return self.choose_replica()
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get the schema through replication
+        return db not in getattr(settings, 'DATABASE_REPLICAS', [])
+
+    def choose_replica(self):
+        return random.choice(settings.DATABASE_REPLICAS)
+
+
+class ReplicaReadMixin:
+    """
+    GETs of the view may read from a replica, unless the user or the
+    view's `replica_scope` wrote within the last REPLICA_LAG_SECONDS.
+    Scopes and users are pinned before their cache version moves, so the
+    catalog cache and ETags are never filled from rows older than the version.
+    """
+    replica_scope = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            self.replica_token = replica_reads.set(self.allow_replica(request))
+
+    def allow_replica(self, request):
+        return replica_allowed(request.user, self.replica_scope)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'replica_token', None)
+        if token is not None:
+            replica_reads.reset(token)
+            self.replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ReplicaPinMiddleware(MiddlewareMixin):
+    """After a successful write, the user reads their own data from the primary for a while."""
+
+    def process_response(self, request, response):
+        user = getattr(request, 'user', None)
+        if (request.method not in SAFE_METHODS and response.status_code < 400
+                and user is not None and user.is_authenticated):
+            pin_to_primary(f'user:{user.pk}')
+        return response
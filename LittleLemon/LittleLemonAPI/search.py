@@ -0,0 +1,177 @@
+import difflib
+import threading
+from collections import defaultdict
+
+from django.db import DatabaseError, connection, connections
+from django.db.models import Q
+
+from .caching import get_catalog_version
+from .models import Category, MenuItem
+
+
+SEARCH_TABLE = 'LittleLemonAPI_menusearch'
+# how close a title word must be to stand in for a misspelt query word
+MIN_SIMILARITY = 0.75
+MAX_ALTERNATIVES = 5
+# the best matches by bm25 that are scored again word by word, FTS5 picks them without sorting every match
+SEARCH_CANDIDATES = 200
+
+# the FTS table follows every write to the menu, bulk ones included
+TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS menusearch_insert AFTER INSERT ON "LittleLemonAPI_menuitem" BEGIN
+        INSERT INTO "{SEARCH_TABLE}" (rowid, title, category)
+        VALUES (new.id, new.title, (SELECT title FROM "LittleLemonAPI_category" WHERE id = new.category_id));
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS menusearch_update AFTER UPDATE OF title, category_id ON "LittleLemonAPI_menuitem" BEGIN
+        UPDATE "{SEARCH_TABLE}" SET title = new.title,
+            category = (SELECT title FROM "LittleLemonAPI_category" WHERE id = new.category_id)
+        WHERE rowid = new.id;
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS menusearch_delete AFTER DELETE ON "LittleLemonAPI_menuitem" BEGIN
+        DELETE FROM "{SEARCH_TABLE}" WHERE rowid = old.id;
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS menusearch_category_update AFTER UPDATE OF title ON "LittleLemonAPI_category" BEGIN
+        UPDATE "{SEARCH_TABLE}" SET category = new.title
+        WHERE rowid IN (SELECT id FROM "LittleLemonAPI_menuitem" WHERE category_id = new.id);
+    END''',
+]
+
+
+def install_triggers(using):
+    """Create the sync triggers, again after a migration rebuilt the menu tables without them."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or SEARCH_TABLE not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        for trigger in TRIGGERS:
+            cursor.execute(trigger)
+
+
+def trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class Vocabulary:
+    """The distinct words of all menu item and category titles, numbers left out."""
+
+    def __init__(self, words):
+        self.words = sorted(words)
+        self.by_trigram = defaultdict(set)
+        for word in self.words:
+            for trigram in trigrams(word):
+                self.by_trigram[trigram].add(word)
+
+    @classmethod
+    def load(cls):
+        titles = [
+            *MenuItem.objects.values_list('title', flat=True).iterator(chunk_size=10000),
+            *Category.objects.values_list('title', flat=True),
+        ]
+        return cls({word for title in titles for word in title.lower().split() if word.isalpha()})
+
+    def starting_with(self, prefix):
+        return [word for word in self.words if word.startswith(prefix)][:MAX_ALTERNATIVES]
+
+    def contains(self, text):
+        return any(text in word for word in self.by_trigram.get(text[:3], ()))
+
+    def similar(self, word):
+        # words sharing a trigram are the candidates, the closest spellings win
+        candidates = set().union(*(self.by_trigram.get(trigram, ()) for trigram in trigrams(word)))
+        scored = []
+        for candidate in candidates:
+            if abs(len(candidate) - len(word)) <= 2:
+                similarity = difflib.SequenceMatcher(None, word, candidate).ratio()
+                if similarity >= MIN_SIMILARITY:
+                    scored.append((-similarity, candidate))
+        return [candidate for _, candidate in sorted(scored)[:MAX_ALTERNATIVES]]
+
+
+vocabularies = {}
+vocabulary_lock = threading.Lock()
+
+
+def get_vocabulary():
+    # once per catalog version and process, every menu write retires it
+    version = get_catalog_version()
+    with vocabulary_lock:
+        if version not in vocabularies:
+            vocabularies.clear()
+            vocabularies[version] = Vocabulary.load()
+        return vocabularies[version]
+
+
+def fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def word_query(word, vocabulary):
+    """The FTS expression for one query word, None when nothing can match it."""
+    if len(word) < 3:
+        # too short for a trigram, the title words it starts stand in
+        alternatives = vocabulary.starting_with(word)
+    elif not word.isalpha() or vocabulary.contains(word):
+        alternatives = [word]
+    else:
+        # unknown, e.g. misspelt, or a word written since the vocabulary was loaded
+        alternatives = [word, *vocabulary.similar(word)]
+    if not alternatives:
+        return None
+    return '(' + ' OR '.join(fts_phrase(alternative) for alternative in alternatives) + ')'
+
+
+def search_menu_items(query, limit):
+    """
+    Ids of menu items whose titles or category titles hold every word of
+    `query`, best first. A word matches anywhere inside a title word, so
+    prefixes work, a misspelt one matches the closest title words instead.
+    """
+    words = query.lower().split()
+    if not words:
+        return []
+    if connection.vendor != 'sqlite':
+        return contains_search(words, limit)
+    vocabulary = get_vocabulary()
+    expressions = [word_query(word, vocabulary) for word in words]
+    if None in expressions:
+        return []
+    try:
+        return ranked_ids(' AND '.join(expressions), words, limit)
+    except DatabaseError:
+        # no FTS5 or no trigram tokenizer in this SQLite build
+        return contains_search(words, limit)
+
+
+def word_score(word, title):
+    """0 when a title word starts with `word`, 1 when one holds it, 2 for a category or misspelt match."""
+    title_words = title.lower().split()
+    if any(title_word.startswith(word) for title_word in title_words):
+        return 0
+    if any(word in title_word for title_word in title_words):
+        return 1
+    return 2
+
+
+def ranked_ids(match, words, limit):
+    table = f'"{SEARCH_TABLE}"'
+    with connection.cursor() as cursor:
+        # FTS5 keeps the best matches as it reads them, a title match weighs more than a category one
+        cursor.execute(
+            f"SELECT rowid, title FROM {table} WHERE {table} MATCH %s AND rank MATCH 'bm25(10.0, 1.0)' "
+            f'ORDER BY rank LIMIT %s',
+            [match, max(limit, SEARCH_CANDIDATES)],
+        )
+        candidates = cursor.fetchall()
+    # sorted() is stable, equal scores keep the bm25 order
+    scored = sorted(
+        candidates,
+        key=lambda row: sum(word_score(word, row[1]) for word in words),
+    )
+    return [row[0] for row in scored[:limit]]
+
+
+def contains_search(words, limit):
+    matches = MenuItem.objects.all()
+    for word in words:
+        matches = matches.filter(Q(title__icontains=word) | Q(category__title__icontains=word))
+    return list(matches.order_by('title', 'id').values_list('id', flat=True)[:limit])
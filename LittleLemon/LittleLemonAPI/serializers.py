@@ -1,21 +1,56 @@
 from django.contrib.auth.models import User, Group
+from django.db import transaction
 from django.shortcuts import get_list_or_404, get_object_or_404
 
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
 from rest_framework.validators import UniqueTogetherValidator
 
 import bleach
 
-from .models import Category, MenuItem, Order, OrderItem, Cart
+from .models import Category, CheckoutJob, MenuItem, Order, OrderItem, Cart
+from .checkout import checkout_cart
 
 
-class CategorySerializer(serializers.ModelSerializer):
+def query_names(request, param):
+    return {name.strip() for name in request.query_params.get(param, '').split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    On reads, ?fields=id,total keeps only the named fields and ?expand=category
+    nests the related objects named in Meta.expandable_fields in place of
+    their ids. Unknown names are ignored. Views build their queries from
+    serializer.fields, so a field left out is not queried either.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        nested = self.field_name or (self.parent is not None and self.parent.field_name)
+        if request is None or request.method not in SAFE_METHODS or nested:
+            return fields
+        expandable = getattr(getattr(self, 'Meta', None), 'expandable_fields', {})
+        for name in query_names(request, 'expand') & set(expandable) & set(fields):
+            fields[name] = expandable[name](read_only=True)
+        only = query_names(request, 'fields')
+        if only:
+            fields = {name: field for name, field in fields.items() if name in only}
+        return fields
+
+    @property
+    def expanded_fields(self):
+        """The relations to join, nested serializers among the fields."""
+        return [field.source for field in self.fields.values() if isinstance(field, serializers.Serializer)]
+
+
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = "__all__"
 
-class MenuItemSerializer(serializers.ModelSerializer):
+class MenuItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     def validate(self, attrs):
         if(attrs['price']<0):
@@ -26,8 +61,9 @@ class MenuItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = MenuItem
         fields = ['id', 'title', 'price', 'featured', 'category']
+        expandable_fields = {'category': CategorySerializer}
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     group = serializers.SerializerMethodField(method_name='get_group')
     
     class Meta:
@@ -40,21 +76,29 @@ class UserSerializer(serializers.ModelSerializer):
         except:
             return "Not in a group"
         
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # user = serializers.PrimaryKeyRelatedField(read_only=True)
     user = serializers.HiddenField(default=serializers.CurrentUserDefault())
     user_name = serializers.CharField(source = 'user.username', read_only=True)
-    menuitem_name = serializers.CharField(source = 'menuitem.title', read_only=True)
+    # annotated by Cart.objects.with_prices(), not read through menuitem line by line
+    menuitem_name = serializers.CharField(source = 'menuitem_title', read_only=True)
+    unit_price = serializers.ReadOnlyField(source='line_unit_price')
+    price = serializers.ReadOnlyField(source='line_price')
 
     def validate(self, attrs):
         if(attrs['quantity']<0):
             raise serializers.ValidationError('Price must be greater than 0')
         (bleach.clean(value) for value in attrs)
         return super().validate(attrs)
+
+    def create(self, validated_data):
+        line = super().create(validated_data)
+        return Cart.objects.with_prices().select_related('user').get(pk=line.pk)
    
     class Meta:
         model = Cart
         fields = ['user', 'user_name', 'menuitem', 'menuitem_name', 'quantity', 'unit_price', 'price']
+        expandable_fields = {'menuitem': MenuItemSerializer}
         validators = [
                 UniqueTogetherValidator(
                     queryset = Cart.objects.all(),
@@ -62,8 +106,40 @@ class CartSerializer(serializers.ModelSerializer):
                 )
             ]
 
+class CartLineListSerializer(serializers.ListSerializer):
+
+    def validate(self, attrs):
+        ids = {line['menuitem'] for line in attrs}
+        unknown = ids - set(MenuItem.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        if unknown:
+            raise serializers.ValidationError({'menuitem': f'Menu items {sorted(unknown)} do not exist'})
+        return attrs
+
+    @transaction.atomic
+    def create(self, validated_data):
+        # one line per menu item, the last one sent wins, quantity 0 removes it
+        quantities = {line['menuitem']: line['quantity'] for line in validated_data}
+        user = validated_data[0]['user'] if validated_data else None
+        removed = [menuitem for menuitem, quantity in quantities.items() if quantity == 0]
+        Cart.objects.filter(user=user, menuitem_id__in=removed).delete()
+        return Cart.objects.bulk_create(
+            [Cart(user=user, menuitem_id=menuitem, quantity=quantity)
+             for menuitem, quantity in quantities.items() if quantity],
+            update_conflicts=True,
+            unique_fields=['menuitem', 'user'],
+            update_fields=['quantity'],
+        )
+
+
+class CartLineSerializer(serializers.Serializer):
+    menuitem = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, max_value=32767)
 
-class OrderSerializer(serializers.ModelSerializer):
+    class Meta:
+        list_serializer_class = CartLineListSerializer
+
+
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(read_only='True')
     delivery_crew = serializers.PrimaryKeyRelatedField(read_only='True')
     status = serializers.BooleanField(read_only=True)
@@ -76,24 +152,7 @@ class OrderSerializer(serializers.ModelSerializer):
 
 
     def create(self, validated_data):
-        user = validated_data['user']
-        cart_items = get_list_or_404(Cart, user=user)
-        if len(cart_items) == 0:
-            raise ValueError(f'your cart has no item in it, no order placed.')
-
-        total = sum(cart_item.price for cart_item in cart_items)
-        order = Order.objects.create(user=user, total=total)
-
-        [OrderItem.objects.create(
-            order = order,
-            menuitem = cart_item.menuitem,
-            quantity = cart_item.quantity,
-            unit_price = cart_item.unit_price,
-            price = cart_item.price
-            ) for cart_item in cart_items]
-        
-        [cart_item.delete() for cart_item in cart_items]
-        return order
+        return checkout_cart(validated_data['user'])
 
 
     def get_items(self, obj):
@@ -130,7 +189,7 @@ class UpdateDeliverCrewSerializer(UpdateStatusSerializer):
         return value
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     order = serializers.PrimaryKeyRelatedField(read_only='True')
     menuitem = serializers.PrimaryKeyRelatedField(read_only='True')
     menuitem_name = serializers.CharField(source='menuitem.title', read_only=True)
@@ -140,7 +199,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
    
 
     class Meta:
-        model = Order
+        model = OrderItem
         fields = ['order', 'menuitem', 'menuitem_name', 'quantity', 'unit_price', 'price']
         validators = [
                 UniqueTogetherValidator(
@@ -148,3 +207,25 @@ class OrderItemSerializer(serializers.ModelSerializer):
                     fields= ['order', 'menuitem']
                 )
             ]
+
+
+class DailyRevenueSerializer(SparseFieldsMixin, serializers.Serializer):
+    date = serializers.DateField()
+    quantity = serializers.IntegerField(source='total_quantity')
+    revenue = serializers.DecimalField(source='total_revenue', decimal_places=2, max_digits=12)
+
+
+class TopSellerSerializer(SparseFieldsMixin, serializers.Serializer):
+    menuitem = serializers.IntegerField()
+    menuitem_name = serializers.CharField(source='menuitem__title')
+    orders = serializers.IntegerField(source='total_orders')
+    quantity = serializers.IntegerField(source='total_quantity')
+    revenue = serializers.DecimalField(source='total_revenue', decimal_places=2, max_digits=12)
+
+
+class CheckoutJobSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+
+    class Meta:
+        model = CheckoutJob
+        fields = ['id', 'status', 'attempts', 'order', 'error', 'created', 'updated']
+        read_only_fields = fields
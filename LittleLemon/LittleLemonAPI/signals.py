@@ -0,0 +1,114 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_migrate, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_auth, token_cache
+from .caching import bump_catalog_version, bump_order_version
+from .checkout import remove_daily_sales, remove_order_sales
+from .dispatch import invalidate_crew
+from .events import record_order_events
+from .middleware import install_sql_recorder
+from .models import Category, MenuItem, Order, OrderEvent, OrderItem
+from .permissions import invalidate_roles
+from .search import install_triggers
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def group_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # membership edited outside the group views, e.g. in the admin
+    if action == 'pre_clear' and reverse:
+        # the members are gone once cleared, they are noted for post_clear
+        instance._cleared_user_ids = list(instance.user_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    elif action == 'post_clear':
+        user_ids = instance.__dict__.pop('_cleared_user_ids', [])
+    else:
+        user_ids = list(pk_set)
+    if user_ids:
+        # after the commit, a read before it would cache the old groups again
+        transaction.on_commit(lambda: membership_changed(user_ids))
+
+
+def membership_changed(user_ids):
+    invalidate_roles(*user_ids)
+    invalidate_auth(*user_ids)
+    invalidate_crew()
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    # deactivated, renamed or deleted, cached tokens must not return the old user
+    invalidate_auth(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    # djoser's logout deletes the token, other workers see the version bump
+    token_cache.delete(instance.key)
+    invalidate_auth(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=MenuItem)
+def catalog_changed(sender, **kwargs):
+    # API and admin writes alike, cached catalog responses go stale at once
+    bump_catalog_version()
+
+
+@receiver([post_save, post_delete], sender=Order)
+def order_changed(sender, instance, signal, **kwargs):
+    bump_order_version([instance.user_id, instance.delivery_crew_id, getattr(instance, 'loaded_crew_id', None)])
+    # views, admin and checkout alike, waiting clients hear of it through the feed
+    record_order_events([OrderEvent(
+        order_id=instance.pk, status=instance.status, delivery_crew_id=instance.delivery_crew_id,
+        deleted=signal is post_delete,
+    )])
+
+
+def deleted_with_order(origin):
+    """Whether a delete started at orders or their owners, so whole orders go with their items."""
+    return getattr(origin, 'model', type(origin)) in (Order, User)
+
+
+@receiver(pre_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    # one grouped update per order, the item handlers below stand aside
+    remove_order_sales(instance)
+
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def order_item_changed(sender, instance, origin=None, **kwargs):
+    if deleted_with_order(origin):
+        # the order's own post_delete bumps the same versions
+        return
+    users = Order.objects.filter(pk=instance.order_id).values_list('user', 'delivery_crew').first() or ()
+    bump_order_version(users)
+
+
+@receiver(pre_delete, sender=OrderItem)
+def order_item_deleted(sender, instance, origin=None, **kwargs):
+    if deleted_with_order(origin):
+        return
+    # before the order goes too, its date picks the rollup row
+    remove_daily_sales(instance)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    # every thread's connection, the async ORM runs queries on worker threads
+    install_sql_recorder(connection)
+
+
+@receiver(post_migrate)
+def migrated(sender, using, **kwargs):
+    # SQLite drops triggers along with a table a migration rebuilds
+    if sender.name == 'LittleLemonAPI':
+        install_triggers(using)
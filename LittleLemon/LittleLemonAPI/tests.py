@@ -1,3 +1,1450 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import datetime
+import json
+import os
+import re
+import tempfile
+import threading
+import asyncio
+import unittest
+from base64 import urlsafe_b64encode
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from unittest import mock
+
+from django.contrib.auth.models import User, Group
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.test import TestCase, TransactionTestCase, AsyncClient, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import quote_etag
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed, NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import renderers
+from .authentication import CachedTokenAuthentication
+from .caching import get_catalog_version
+from .checkout import cart_lines, checkout_cart, claim_checkout_jobs, place_order, run_checkout_job
+from .dispatch import dispatcher
+from .events import OrderFeed
+from .management.commands import bench_api
+from .models import Category, CheckoutJob, MenuItem, Order, OrderEvent, OrderItem, Cart, DailySales
+from .permissions import IsManager, IsDeliveryCrew
+from .routers import ReplicaRouter, replica_reads
+from .pagination import OrderPagination
+from .parsers import FastJSONParser
+from .serializers import OrderSerializer
+from .throttling import TokenBucketStore, get_store
+from .views import CartView, CategoryView, MenuItemView, OrderDerailView, OrderView
+
+
+# the suite runs on caches of its own, not on the project's cache directory
+test_caches = override_settings(CACHES={
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'tests-{alias}'}
+    for alias in ['default', 'versions']
+})
+
+
+def setUpModule():
+    test_caches.enable()
+
+
+def tearDownModule():
+    test_caches.disable()
+
+
+def clear_caches():
+    for alias in ['default', 'versions']:
+        caches[alias].clear()
+
+
+class APITestCase(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        # token buckets per test, not in a file next to the project
+        throttle_store = self.settings(THROTTLE_STORE=':memory:')
+        throttle_store.enable()
+        self.addCleanup(throttle_store.disable)
+        get_store().clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(slug='mains', title='Mains')
+        self.customer = User.objects.create_user('customer', password='secret')
+
+    def make_menu(self, size):
+        return MenuItem.objects.bulk_create([
+            MenuItem(title=f'Dish {i}', price=Decimal('2.50') + i, featured=False, category=self.category)
+            for i in range(size)
+        ])
+
+    def assertConstantQueries(self, path, sizes=(2, 10)):
+        """Fail when a list endpoint runs more queries for a bigger page."""
+        counts = []
+        self.client.get(path, {'limit': sizes[0]})  # warm up caches
+        for size in sizes:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(path, {'limit': size})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), size)
+            counts.append(len(queries))
+        self.assertEqual(len(set(counts)), 1, f'{path} ran {counts} queries for page sizes {sizes}')
+
+    def fill_cart(self, user, size):
+        Cart.objects.bulk_create([
+            Cart(user=user, menuitem=item, quantity=2) for item in self.make_menu(size)
+        ])
+
+
+class CheckoutTest(APITestCase):
+
+    def checkout(self):
+        serializer = OrderSerializer(data={})
+        serializer.is_valid(raise_exception=True)
+        with CaptureQueriesContext(connection) as queries:
+            order = serializer.save(user=self.customer)
+        return order, len(queries)
+
+    def test_checkout_moves_cart_into_order(self):
+        self.fill_cart(self.customer, 3)
+        order, _ = self.checkout()
+
+        self.assertEqual(order.total, Decimal('2.50') * 2 + Decimal('3.50') * 2 + Decimal('4.50') * 2)
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+        item = OrderItem.objects.get(order=order, menuitem__title='Dish 1')
+        self.assertEqual((item.quantity, item.unit_price, item.price), (2, Decimal('3.50'), Decimal('7.00')))
+        self.assertFalse(Cart.objects.filter(user=self.customer).exists())
+
+    def test_checkout_query_count_does_not_grow_with_cart(self):
+        # the first checkout also loads the dispatch engine
+        self.fill_cart(self.customer, 1)
+        self.checkout()
+        self.fill_cart(self.customer, 1)
+        _, small = self.checkout()
+        self.fill_cart(self.customer, 20)
+        _, large = self.checkout()
+        self.assertEqual(small, large)
+
+    def test_empty_cart_is_not_found(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.post('/api/orders')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderListingTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        for _ in range(12):
+            self.fill_cart(self.customer, 5)
+            OrderSerializer().create({'user': self.customer})
+        self.client.force_authenticate(self.customer)
+
+    def test_order_list_query_count_is_constant(self):
+        self.assertConstantQueries('/api/orders')
+
+    def test_order_list_includes_items(self):
+        response = self.client.get('/api/orders', {'limit': 1})
+        items = response.data['results'][0]['order_items']
+        self.assertEqual(len(items), 5)
+        self.assertEqual(items[0]['menuitem_name'], 'Dish 0')
+
+    def test_owner_sees_items_on_order_detail(self):
+        order = Order.objects.first()
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/orders/{order.pk}')
+        self.assertEqual(len(response.data['order_items']), 5)
+
+
+class RoleCacheTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.manager = User.objects.create_user('manager', password='secret')
+        Group.objects.create(name='Manager').user_set.add(self.manager)
+        Group.objects.create(name='Delivery crew')
+
+    def test_roles_are_loaded_once_and_shared(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(IsManager(self.manager))
+            self.assertFalse(IsDeliveryCrew(self.manager))
+        fresh = User.objects.get(pk=self.manager.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(IsManager(fresh))
+
+    def test_group_views_invalidate_roles(self):
+        self.assertFalse(IsDeliveryCrew(self.customer))
+        self.client.force_authenticate(self.manager)
+        response = self.client.post('/api/groups/delivery-crew/users', {'username': 'customer'})
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(IsDeliveryCrew(User.objects.get(pk=self.customer.pk)))
+
+        response = self.client.delete(f'/api/groups/delivery-crew/users/{self.customer.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(IsDeliveryCrew(User.objects.get(pk=self.customer.pk)))
+
+    def test_admin_membership_changes_invalidate_roles(self):
+        self.assertFalse(IsManager(self.customer))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.groups.add(Group.objects.get(name='Manager'))
+        self.assertTrue(IsManager(User.objects.get(pk=self.customer.pk)))
+
+    def test_membership_clears_invalidate_roles(self):
+        manager = Group.objects.get(name='Manager')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.groups.add(manager)
+        self.assertTrue(IsManager(User.objects.get(pk=self.customer.pk)))
+        with self.captureOnCommitCallbacks(execute=True):
+            manager.user_set.clear()
+        self.assertFalse(IsManager(User.objects.get(pk=self.customer.pk)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.groups.add(manager)
+        self.assertTrue(IsManager(User.objects.get(pk=self.customer.pk)))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.groups.clear()
+        self.assertFalse(IsManager(User.objects.get(pk=self.customer.pk)))
+
+
+class CatalogCacheTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.make_menu(3)
+
+    def test_cached_menu_is_served_without_sql(self):
+        first = self.client.get('/api/menu-items', {'ordering': '-price'})
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/menu-items', {'ordering': '-price'})
+        self.assertEqual(first.data, second.data)
+        with self.assertNumQueries(2):
+            self.client.get('/api/menu-items', {'ordering': 'price'})
+
+    def test_catalog_writes_invalidate_cache(self):
+        item = MenuItem.objects.first()
+        self.client.get(f'/api/menu-items/{item.pk}')
+        self.client.get('/api/category')
+
+        item.title = 'Lemon tart'
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        self.assertEqual(self.client.get(f'/api/menu-items/{item.pk}').data['title'], 'Lemon tart')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(slug='desserts', title='Desserts')
+        self.assertEqual(self.client.get('/api/category').data['count'], 2)
+
+    def test_version_moves_when_the_write_commits(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            MenuItem.objects.first().save()
+        # a reader before the commit still sees the old rows, they stay under the old version
+        self.assertEqual(get_catalog_version(), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_catalog_version(), version)
+
+
+class ConditionalGetTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.fill_cart(self.customer, 2)
+        self.order = OrderSerializer().create({'user': self.customer})
+        self.client.force_authenticate(self.customer)
+
+    def assertNotModified(self, path):
+        etag = self.client.get(path)['ETag']
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        return etag
+
+    def test_menu_list_not_modified(self):
+        etag = self.assertNotModified('/api/menu-items')
+        MenuItem.objects.update(featured=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            MenuItem.objects.first().save()
+        self.assertEqual(self.client.get('/api/menu-items', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_order_detail_not_modified(self):
+        path = f'/api/orders/{self.order.pk}'
+        etag = self.assertNotModified(path)
+        # only the permission check, the order and its items are not read
+        with self.assertNumQueries(1):
+            self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+
+        self.order.status = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.save()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['status'])
+
+    def test_queryset_updates_retire_order_etags(self):
+        path = f'/api/orders/{self.order.pk}'
+        etag = self.assertNotModified(path)
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.filter(pk=self.order.pk).update(status=True)
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_no_304_without_permission(self):
+        path = f'/api/orders/{self.order.pk}'
+        self.client.force_authenticate(User.objects.create_user('other', password='secret'))
+        # even with the right ETag the order is not confirmed to someone who may not read it
+        with mock.patch.object(OrderDerailView, 'get_etag_parts', return_value=['known']):
+            etag = quote_etag(hashlib.sha1(b'known').hexdigest())
+            self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 403)
+            self.assertEqual(self.client.get('/api/orders/999', HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+
+class OrderCursorPaginationTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        Order.objects.bulk_create([
+            Order(user=self.customer, total=Decimal(i % 4)) for i in range(11)
+        ])
+        self.client.force_authenticate(self.customer)
+
+    def walk(self, ordering):
+        ids, url, params = [], '/api/orders', {'cursor': '', 'limit': 3, 'ordering': ordering}
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+            ids += [order['id'] for order in response.data['results']]
+            url, params = response.data['next'], None
+        return ids, response
+
+    def test_cursor_pages_follow_ordering_with_id_tiebreaker(self):
+        ids, _ = self.walk('-total')
+        expected = list(Order.objects.order_by('-total', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.client.get('/api/orders', {'cursor': '', 'limit': 4, 'ordering': 'total'}).data
+        second = self.client.get(first['next']).data
+        self.assertIsNone(first['previous'])
+        self.assertEqual(self.client.get(second['previous']).data['results'], first['results'])
+
+    def test_offset_pagination_without_cursor(self):
+        response = self.client.get('/api/orders', {'offset': 10})
+        self.assertEqual(response.data['count'], 11)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_tampered_cursors_are_rejected(self):
+        def cursor(position):
+            return urlsafe_b64encode(json.dumps([['-date', '-id'], position, False]).encode()).decode()
+
+        # through the paginator, the order list would throttle this many requests
+        for position in [['not a date', 1], [{'year': 2023}, 1], [[1], 1], ['2023-01-01', 'one'], [None, 1], [1]]:
+            request = Request(APIRequestFactory().get('/api/orders', {'cursor': cursor(position)}))
+            with self.subTest(position=position), self.assertRaises(NotFound):
+                OrderPagination().paginate_queryset(Order.objects.all(), request)
+        response = self.client.get('/api/orders', {'cursor': cursor(['not a date', 1])})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_for_another_ordering_is_rejected(self):
+        first = self.client.get('/api/orders', {'cursor': '', 'limit': 4, 'ordering': 'total'}).data
+        response = self.client.get(first['next'].replace('ordering=total', 'ordering=date'))
+        self.assertEqual(response.status_code, 404)
+
+
+class OrderExportTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        for _ in range(3):
+            self.fill_cart(self.customer, 2)
+            OrderSerializer().create({'user': self.customer})
+        Order.objects.filter(pk=Order.objects.first().pk).update(status=True)
+        self.manager = User.objects.create_user('manager', password='secret')
+        Group.objects.create(name='Manager').user_set.add(self.manager)
+        self.client.force_authenticate(self.manager)
+
+    def content(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_export_streams_one_order_per_line(self):
+        lines = self.content(self.client.get('/api/orders/export', {'status': False})).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(len(json.loads(lines[0])['order_items']), 2)
+
+    def test_csv_export_streams_one_row_per_item(self):
+        response = self.client.get('/api/orders/export', {'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(self.content(response))))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0]['menuitem_name'], 'Dish 0')
+
+    def test_export_is_for_managers_only(self):
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get('/api/orders/export').status_code, 403)
+
+    async def test_export_under_asgi(self):
+        # through the ASGI handler, AsyncClient would read the body on a worker thread
+        token = await Token.objects.acreate(user=self.manager)
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await ASGIHandler()({
+            'type': 'http', 'method': 'GET', 'path': '/api/orders/export', 'query_string': b'format=csv',
+            'headers': [(b'host', b'testserver'), (b'authorization', f'Token {token.key}'.encode())],
+        }, receive, send)
+        self.assertEqual(messages[0]['status'], 200)
+        body = b''.join(message.get('body', b'') for message in messages[1:]).decode()
+        self.assertEqual(len(list(csv.DictReader(io.StringIO(body)))), 6)
+
+
+class DailySalesTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        menu = self.make_menu(2)
+        for quantities in [(1, 2), (3, 0)]:
+            Cart.objects.bulk_create([
+                Cart(user=self.customer, menuitem=item, quantity=quantity)
+                for item, quantity in zip(menu, quantities) if quantity
+            ])
+            OrderSerializer().create({'user': self.customer})
+        self.manager = User.objects.create_user('manager', password='secret')
+        Group.objects.create(name='Manager').user_set.add(self.manager)
+
+    def rollup(self):
+        return list(DailySales.objects.order_by('menuitem').values_list('orders', 'quantity', 'revenue'))
+
+    def test_checkout_updates_rollup(self):
+        self.assertEqual(self.rollup(), [(2, 4, Decimal('10.00')), (1, 2, Decimal('7.00'))])
+
+    def test_rebuild_matches_incremental_rollup(self):
+        incremental = self.rollup()
+        call_command('rebuild_daily_sales', stdout=io.StringIO())
+        self.assertEqual(self.rollup(), incremental)
+
+    def test_deleted_orders_leave_the_rollup(self):
+        Order.objects.order_by('pk').first().delete()
+        self.assertEqual(self.rollup(), [(1, 3, Decimal('7.50'))])
+        Order.objects.all().delete()
+        self.assertEqual(self.rollup(), [])
+
+    def test_order_deletes_do_not_grow_with_their_items(self):
+        first, second = Order.objects.order_by('pk')
+        # two items and one item, the same statements either way
+        with CaptureQueriesContext(connection) as two_items:
+            first.delete()
+        with CaptureQueriesContext(connection) as one_item:
+            second.delete()
+        self.assertEqual(len(two_items), len(one_item))
+        self.assertEqual(self.rollup(), [])
+
+    def test_deleted_items_and_owners_leave_the_rollup(self):
+        OrderItem.objects.filter(quantity=2).delete()
+        self.assertEqual(self.rollup(), [(2, 4, Decimal('10.00'))])
+        self.customer.delete()
+        self.assertEqual(self.rollup(), [])
+
+    def test_saving_an_order_keeps_its_date(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        Order.objects.update(date=yesterday)
+        call_command('rebuild_daily_sales', stdout=io.StringIO())
+        order = Order.objects.first()
+        order.status = True
+        order.save()
+        self.assertEqual(Order.objects.get(pk=order.pk).date, yesterday)
+        rollup = self.rollup()
+        call_command('rebuild_daily_sales', stdout=io.StringIO())
+        self.assertEqual(self.rollup(), rollup)
+
+    def test_reports(self):
+        self.client.force_authenticate(self.manager)
+        sales = self.client.get('/api/reports/sales').data['results']
+        self.assertEqual([(row['quantity'], row['revenue']) for row in sales], [(6, '17.00')])
+        top = self.client.get('/api/reports/top-sellers', {'limit': 1}).data['results']
+        self.assertEqual(top[0]['menuitem_name'], 'Dish 0')
+        self.assertEqual(top[0]['orders'], 2)
+
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get('/api/reports/sales').status_code, 403)
+
+
+class MenuImportTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.make_menu(1)
+        Category.objects.create(slug='desserts', title='Desserts')
+        self.manager = User.objects.create_user('manager', password='secret')
+        Group.objects.create(name='Manager').user_set.add(self.manager)
+        self.client.force_authenticate(self.manager)
+
+    def test_json_import_creates_and_updates(self):
+        self.client.get('/api/menu-items')
+        rows = [
+            {'title': 'Dish 0', 'price': '9.00', 'featured': True, 'category': 'mains'},
+            {'title': 'Lemon tart', 'price': '4.50', 'category': 'desserts'},
+        ]
+        with self.assertNumQueries(7), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/menu-items/bulk', rows, format='json')
+        self.assertEqual((response.data['created'], response.data['updated']), (1, 1))
+        self.assertEqual(MenuItem.objects.get(title='Dish 0').price, Decimal('9.00'))
+        self.assertEqual(self.client.get('/api/menu-items').data['count'], 2)
+
+    def test_csv_import(self):
+        body = 'title,price,featured,category\nLemon tart,4.50,false,desserts\nLemonade,2.00,true,mains\n'
+        response = self.client.post('/api/menu-items/bulk', body, content_type='text/csv')
+        self.assertEqual(response.data['created'], 2)
+        self.assertTrue(MenuItem.objects.get(title='Lemonade').featured)
+
+    def test_invalid_rows_are_reported_and_nothing_is_written(self):
+        rows = [
+            {'title': 'Lemon tart', 'price': '4.50', 'category': 'desserts'},
+            {'title': 'Soup', 'price': '-1', 'category': 'mains'},
+            {'title': 'Pie', 'price': '3.00', 'category': 'pies'},
+        ]
+        response = self.client.post('/api/menu-items/bulk', rows, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['row'] for error in response.data['errors']], [1, 2])
+        self.assertFalse(MenuItem.objects.filter(title='Lemon tart').exists())
+
+    def test_keys_matching_several_rows_are_rejected(self):
+        MenuItem.objects.create(title='Dish 0', price=Decimal('1.00'), featured=False, category=self.category)
+        Category.objects.create(slug='desserts', title='More desserts')
+        rows = [
+            {'title': 'Dish 0', 'price': '9.00', 'category': 'mains'},
+            {'title': 'Lemon tart', 'price': '4.50', 'category': 'desserts'},
+        ]
+        response = self.client.post('/api/menu-items/bulk', rows, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([list(error['errors']) for error in response.data['errors']], [['title'], ['category']])
+        self.assertEqual(set(MenuItem.objects.filter(title='Dish 0').values_list('price', flat=True)), {
+            Decimal('2.50'), Decimal('1.00'),
+        })
+
+
+class CartBatchTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.menu = self.make_menu(15)
+        self.client.force_authenticate(self.customer)
+
+    def test_batch_upsert_builds_cart_in_one_request(self):
+        Cart.objects.create(user=self.customer, menuitem=self.menu[0], quantity=1)
+        Cart.objects.create(user=self.customer, menuitem=self.menu[1], quantity=1)
+        lines = [{'menuitem': item.pk, 'quantity': 3} for item in self.menu[2:]]
+        lines += [{'menuitem': self.menu[0].pk, 'quantity': 5}, {'menuitem': self.menu[1].pk, 'quantity': 0}]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/cart/menu-items', lines, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(queries), 10)
+        self.assertEqual(Cart.objects.get(menuitem=self.menu[0]).quantity, 5)
+        self.assertFalse(Cart.objects.filter(menuitem=self.menu[1]).exists())
+        self.assertEqual(Cart.objects.filter(user=self.customer).count(), 14)
+
+    def test_unknown_menu_item_is_rejected(self):
+        response = self.client.post('/api/cart/menu-items', [{'menuitem': 999, 'quantity': 1}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Cart.objects.exists())
+
+
+class CartSummaryTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.customer)
+
+    def test_summary_covers_the_whole_cart(self):
+        self.fill_cart(self.customer, 12)
+        response = self.client.get('/api/cart/menu-items', {'limit': 5})
+        self.assertEqual(response.status_code, 200)
+        subtotal = sum((Decimal('2.50') + i) * 2 for i in range(12))
+        self.assertEqual(
+            (response.data['count'], response.data['item_count'], response.data['subtotal']), (12, 24, subtotal),
+        )
+        line = response.data['results'][1]
+        self.assertEqual(
+            (line['user_name'], line['menuitem_name'], line['quantity'], line['unit_price'], line['price']),
+            ('customer', 'Dish 1', 2, Decimal('3.50'), Decimal('7.00')),
+        )
+
+    def test_cart_loads_in_two_queries(self):
+        self.fill_cart(self.customer, 12)
+        self.assertConstantQueries('/api/cart/menu-items', sizes=(1, 12))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/cart/menu-items')
+        self.assertEqual(len(queries), 2)
+
+    def test_empty_cart_sums_to_zero(self):
+        response = self.client.get('/api/cart/menu-items')
+        self.assertEqual((response.data['count'], response.data['item_count'], response.data['subtotal']), (0, 0, 0))
+
+    def test_added_line_comes_back_priced(self):
+        item = self.make_menu(2)[1]
+        response = self.client.post('/api/cart/menu-items', {'menuitem': item.pk, 'quantity': 3})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['menuitem_name'], response.data['price']), ('Dish 1', Decimal('10.50')))
+
+
+class SparseFieldsTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        for _ in range(3):
+            self.fill_cart(self.customer, 3)
+            OrderSerializer().create({'user': self.customer})
+        self.client.force_authenticate(self.customer)
+
+    def get(self, path, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return response, ' '.join(query['sql'] for query in queries)
+
+    def test_orders_without_items_skip_them(self):
+        response, sql = self.get('/api/orders', {'fields': 'id,total,status,bogus'})
+        self.assertEqual(list(response.data['results'][0]), ['id', 'status', 'total'])
+        self.assertNotIn('orderitem', sql)
+
+        order = Order.objects.first()
+        response, sql = self.get(f'/api/orders/{order.pk}', {'fields': 'id,total'})
+        self.assertEqual(response.data, {'id': order.pk, 'total': '{:.2f}'.format(order.total)})
+        self.assertNotIn('orderitem', sql)
+
+    def test_keyset_pages_with_sparse_fields(self):
+        first = self.client.get('/api/orders', {'fields': 'id', 'cursor': '', 'limit': 2}).data
+        second = self.client.get(first['next']).data
+        self.assertEqual(len(first['results'] + second['results']), 3)
+        self.assertEqual(list(second['results'][0]), ['id'])
+
+    def test_expanded_category_matches_serializer(self):
+        item = MenuItem.objects.first()
+        params = {'expand': 'category', 'fields': 'id,title,category', 'limit': 3}
+        fast = self.client.get('/api/menu-items', params).data['results']
+        clear_caches()
+        with mock.patch.object(MenuItemView, 'values_serialization', False):
+            slow = self.client.get('/api/menu-items', params).data['results']
+        self.assertEqual(fast, slow)
+        self.assertEqual(fast[0]['category'], {'id': self.category.pk, 'slug': 'mains', 'title': 'Mains'})
+
+        response, sql = self.get(f'/api/menu-items/{item.pk}', {'expand': 'category'})
+        self.assertEqual(response.data['category']['title'], 'Mains')
+        self.assertEqual(sql.count('SELECT'), 1)
+        self.assertEqual(self.client.get(f'/api/menu-items/{item.pk}').data['category'], self.category.pk)
+
+    def test_cart_menu_items_expand(self):
+        self.fill_cart(self.customer, 2)
+        response, _ = self.get('/api/cart/menu-items', {'expand': 'menuitem', 'fields': 'menuitem,quantity'})
+        self.assertEqual(response.data['results'][0], {
+            'menuitem': {'id': response.data['results'][0]['menuitem']['id'], 'title': 'Dish 0',
+                         'price': '2.50', 'featured': False, 'category': self.category.pk},
+            'quantity': 2,
+        })
+
+    def test_writes_ignore_fields(self):
+        item = MenuItem.objects.first()
+        response = self.client.post('/api/cart/menu-items?fields=quantity', {'menuitem': item.pk, 'quantity': 1})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['menuitem_name'], item.title)
+
+
+class ValuesListTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        for _ in range(3):
+            self.fill_cart(self.customer, 3)
+            OrderSerializer().create({'user': self.customer})
+        Order.objects.bulk_create([Order(user=self.customer, total=0)])
+        self.client.force_authenticate(self.customer)
+
+    def assertSameOutput(self, view, path, params=None):
+        fast = self.client.get(path, params).content
+        clear_caches()
+        with mock.patch.object(view, 'values_serialization', False):
+            slow = self.client.get(path, params).content
+        self.assertEqual(fast, slow)
+
+    def test_menu_output_matches_serializer(self):
+        self.assertSameOutput(MenuItemView, '/api/menu-items', {'ordering': '-price', 'limit': 5})
+
+    def test_cart_output_matches_serializer(self):
+        self.fill_cart(self.customer, 3)
+        self.assertSameOutput(CartView, '/api/cart/menu-items')
+
+    def test_category_output_matches_serializer(self):
+        self.assertSameOutput(CategoryView, '/api/category')
+
+    def test_order_output_matches_serializer(self):
+        self.assertSameOutput(OrderView, '/api/orders')
+        self.assertSameOutput(OrderView, '/api/orders', {'cursor': '', 'limit': 2, 'ordering': 'total'})
+
+    def test_order_items_come_from_one_query(self):
+        self.assertConstantQueries('/api/orders', sizes=(1, 4))
+
+
+class FastJSONTest(TestCase):
+    payload = {
+        'count': 2,
+        'results': [{
+            'id': 1, 'total': '12.50', 'status': False, 'date': datetime.date(2023, 3, 19),
+            'placed': datetime.datetime(2023, 3, 19, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            'raw': Decimal('7.25'), 'title': 'Crème brûlée \u2028', 'items': (1, 2), 1: None,
+        }],
+    }
+
+    def test_output_matches_stdlib_renderer(self):
+        self.assertEqual(renderers.FastJSONRenderer().render(self.payload), JSONRenderer().render(self.payload))
+
+    def test_falls_back_without_orjson(self):
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.FastJSONRenderer().render(self.payload), JSONRenderer().render(self.payload))
+
+    def test_indented_output_uses_stdlib(self):
+        rendered = renderers.FastJSONRenderer().render({'a': 1}, 'application/json; indent=2')
+        self.assertEqual(rendered, b'{\n  "a": 1\n}')
+
+    def test_parser(self):
+        data = FastJSONParser().parse(io.BytesIO('{"title": "Crème", "price": 1.5}'.encode()))
+        self.assertEqual(data, {'title': 'Crème', 'price': 1.5})
+
+
+class AsyncReadTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        for _ in range(2):
+            self.fill_cart(self.customer, 3)
+            OrderSerializer().create({'user': self.customer})
+        self.order = Order.objects.first()
+        self.token = Token.objects.create(user=self.customer).key
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.async_client = AsyncClient()
+
+    async def assertSameAsSync(self, path, params=None):
+        # AsyncClient passes extra keys on as ASGI header names
+        response = await self.async_client.get(f'/api/async/{path}', params, AUTHORIZATION=f'Token {self.token}')
+        expected = await sync_to_async(self.client.get)(f'/api/{path}', params)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content.replace(b'/api/async/', b'/api/'), expected.content)
+
+    async def test_catalog_matches_sync_views(self):
+        item = await MenuItem.objects.afirst()
+        await self.assertSameAsSync('menu-items', {'ordering': '-price', 'limit': 2, 'offset': 1})
+        await self.assertSameAsSync(f'menu-items/{item.pk}')
+        await self.assertSameAsSync('category')
+        await self.assertSameAsSync('menu-items/999')
+
+    async def test_orders_match_sync_views(self):
+        await self.assertSameAsSync('orders')
+        await self.assertSameAsSync('orders', {'cursor': '', 'limit': 1, 'ordering': 'total'})
+        await self.assertSameAsSync(f'orders/{self.order.pk}')
+        await self.assertSameAsSync(f'orders/{self.order.pk}', {'fields': 'id,total'})
+
+    async def test_sparse_fields_and_expansion_match_sync_views(self):
+        item = await MenuItem.objects.afirst()
+        await self.assertSameAsSync('menu-items', {'fields': 'id,category', 'expand': 'category'})
+        await self.assertSameAsSync(f'menu-items/{item.pk}', {'expand': 'category'})
+        await self.assertSameAsSync('orders', {'fields': 'id,total', 'cursor': '', 'limit': 1})
+
+    async def test_orders_need_authentication_and_permission(self):
+        response = await AsyncClient().get('/api/async/orders')
+        self.assertEqual(response.status_code, 401)
+        other = await sync_to_async(User.objects.create_user)('other', password='secret')
+        token = await Token.objects.acreate(user=other)
+        response = await AsyncClient().get(f'/api/async/orders/{self.order.pk}', AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(response.status_code, 403)
+
+    async def test_orders_share_the_sync_throttle(self):
+        # OrderView allows 5/minute, requests on either route take from the same bucket
+        for _ in range(3):
+            self.assertEqual((await sync_to_async(self.client.get)('/api/orders')).status_code, 200)
+        for _ in range(2):
+            response = await self.async_client.get('/api/async/orders', AUTHORIZATION=f'Token {self.token}')
+            self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get('/api/async/orders', AUTHORIZATION=f'Token {self.token}')
+        self.assertEqual(response.status_code, 429)
+        self.assertAlmostEqual(int(response['Retry-After']), 12, delta=1)
+
+
+class LoadBenchmarkTest(TestCase):
+
+    def setUp(self):
+        clear_caches()
+
+    def test_seed_data_fills_every_role(self):
+        call_command('seed_data', scale=0.001, categories=3000, menu_items=20000, stdout=io.StringIO())
+        self.assertEqual(Category.objects.count(), 3)
+        self.assertEqual(MenuItem.objects.count(), 20)
+        self.assertEqual(User.objects.count(), 100)
+        self.assertEqual(Order.objects.count(), 2000)
+        self.assertEqual(User.objects.filter(groups__name='Manager').count(), 1)
+        self.assertEqual(User.objects.filter(groups__name='Delivery crew').count(), 2)
+        self.assertFalse(Order.objects.filter(order_items__isnull=True).exists())
+        self.assertEqual(DailySales.objects.aggregate(total=Sum('quantity'))['total'],
+                         OrderItem.objects.aggregate(total=Sum('quantity'))['total'])
+
+    def test_bench_api_reports_every_route(self):
+        call_command('seed_data', scale=0.0001, users=200000, menu_items=100000, stdout=io.StringIO())
+        output = io.StringIO()
+        call_command('bench_api', concurrency=1, requests=3, warmup=1, stdout=output, stderr=io.StringIO())
+        report = json.loads(output.getvalue())
+        # the POST routes only run with --writes
+        self.assertEqual(len(report['routes']), len([route for route in bench_api.ROUTES if route[1] == 'GET']))
+        for name, result in report['routes'].items():
+            self.assertEqual(result['statuses'], [200], name)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'], name)
+        self.assertGreater(report['routes']['GET /api/orders as customer']['queries_per_request'], 0)
+
+
+class RequestTimingTest(APITestCase):
+
+    def server_timing(self, response):
+        metrics = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    def test_server_timing_counts_queries(self):
+        self.make_menu(3)
+        self.client.force_authenticate(self.customer)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/menu-items')
+        metrics = self.server_timing(response)
+        self.assertEqual(metrics['sql']['desc'], f'"{len(queries)} queries (0 duplicate)"')
+        view, render, total = (float(metrics[name]['dur']) for name in ('view', 'render', 'total'))
+        self.assertGreaterEqual(total, view + render - 0.1)
+
+    async def test_async_views_are_timed(self):
+        await sync_to_async(self.make_menu)(3)
+        response = await AsyncClient().get('/api/async/menu-items')
+        self.assertEqual(self.server_timing(response)['sql']['desc'], '"2 queries (0 duplicate)"')
+
+    def test_slow_requests_are_logged_with_their_sql(self):
+        item = self.make_menu(1)[0]
+        with self.settings(SLOW_REQUEST_MS=0), self.assertLogs('LittleLemonAPI.middleware') as logs:
+            self.client.get(f'/api/menu-items/{item.pk}')
+        record = logs.records[0].timing
+        self.assertEqual(record['path'], f'/api/menu-items/{item.pk}')
+        self.assertEqual(record['queries'], 1)
+        self.assertIn('FROM "LittleLemonAPI_menuitem"', record['top_sql'][0]['sql'])
+
+
+class ReplicaRoutingTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.make_menu(2)
+        self.client.force_authenticate(self.customer)
+        # a replica alias pointing at the test database, calls to it are counted
+        self.replicas = self.settings(DATABASE_REPLICAS=['default'])
+        self.replicas.enable()
+        self.addCleanup(self.replicas.disable)
+        self.choose_replica = mock.patch.object(ReplicaRouter, 'choose_replica', return_value='default').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_router_sends_only_reads_in_replica_views_to_replicas(self):
+        router = ReplicaRouter()
+        with self.settings(DATABASE_REPLICAS=['replica1']):
+            self.assertEqual(router.db_for_read(MenuItem), 'default')
+            token = replica_reads.set(True)
+            try:
+                router.db_for_read(MenuItem)
+                self.assertEqual(router.db_for_read(User), 'default')
+                self.assertEqual(router.db_for_write(MenuItem), 'default')
+            finally:
+                replica_reads.reset(token)
+            self.assertEqual(self.choose_replica.call_count, 1)
+            self.assertFalse(router.allow_migrate('replica1', 'LittleLemonAPI'))
+
+    def read_from_replica(self, path):
+        self.choose_replica.reset_mock()
+        self.assertEqual(self.client.get(path).status_code, 200)
+        return self.choose_replica.called
+
+    def test_list_views_read_from_replicas(self):
+        self.assertTrue(self.read_from_replica('/api/menu-items'))
+        self.assertTrue(self.read_from_replica('/api/category'))
+        self.assertFalse(self.read_from_replica('/api/cart/menu-items'))
+
+    def test_writes_pin_reads_to_the_primary(self):
+        other = User.objects.create_user('other', password='secret')
+        item = MenuItem.objects.first()
+        response = self.client.post('/api/cart/menu-items', {'menuitem': item.pk, 'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(self.read_from_replica('/api/orders'))
+
+        self.client.force_authenticate(other)
+        self.assertTrue(self.read_from_replica('/api/orders'))
+
+        # a catalog write pins the catalog for everyone
+        with self.captureOnCommitCallbacks(execute=True):
+            MenuItem.objects.create(title='Soup', price=Decimal('3.00'), featured=False, category=self.category)
+        self.assertFalse(self.read_from_replica('/api/menu-items'))
+
+    def test_order_writes_pin_only_the_users_involved(self):
+        other, crew, new_crew = [User.objects.create_user(name, password='secret') for name in ('other', 'crew', 'new')]
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=other, delivery_crew=crew)
+        # someone else's checkout leaves this customer's list on the replica
+        self.assertTrue(self.read_from_replica('/api/orders'))
+        for user in (other, crew):
+            self.client.force_authenticate(user)
+            self.assertFalse(self.read_from_replica('/api/orders'))
+
+        clear_caches()
+        order = Order.objects.get(pk=order.pk)
+        order.delivery_crew = new_crew
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+        # the crew member the order left sees the change too
+        self.assertFalse(self.read_from_replica('/api/orders'))
+
+        clear_caches()
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.filter(pk=order.pk).update(delivery_crew=crew)
+        for user, pinned in ((new_crew, True), (crew, True), (self.customer, False)):
+            self.client.force_authenticate(user)
+            self.assertEqual(self.read_from_replica('/api/orders'), not pinned)
+
+    def test_bulk_order_updates_bump_once_per_user(self):
+        crew = User.objects.create_user('crew', password='secret')
+        Order.objects.bulk_create([Order(user=self.customer, delivery_crew=crew) for _ in range(5)])
+        with mock.patch('LittleLemonAPI.caching.bump_version') as bump_version, \
+                self.captureOnCommitCallbacks(execute=True):
+            Order.objects.update(status=True)
+        # the managers' version, the customer's and the crew member's
+        self.assertEqual(bump_version.call_count, 3)
+
+    def test_manager_order_lists_stay_on_the_primary(self):
+        manager = User.objects.create_user('manager', password='secret')
+        manager.groups.add(Group.objects.create(name='Manager'))
+        self.client.force_authenticate(manager)
+        self.assertFalse(self.read_from_replica('/api/orders'))
+        self.assertTrue(self.read_from_replica('/api/menu-items'))
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'plan lines are matched in the SQLite format')
+class QueryPlanTest(APITestCase):
+    """
+    EXPLAIN every query of the hot list requests. The order, menu item and
+    sales queries must go through one of the indexes listed and never scan
+    their table, no other query may read a whole table or sort it. Only the
+    plan lines' shape is relied on, their wording varies between SQLite
+    versions and the planner may pick any of several fitting indexes.
+    """
+    hot_requests = [
+        # counted and paged by offset, any index leading with the user serves both
+        ('customer', '/api/orders', 'LittleLemonAPI_order', ['order_user_date_idx', 'order_user_total_idx']),
+        ('customer', '/api/orders?cursor=', 'LittleLemonAPI_order', ['order_user_date_idx']),
+        ('customer', '/api/orders?cursor=&ordering=-total', 'LittleLemonAPI_order', ['order_user_total_idx']),
+        ('customer', '/api/orders/{order}', 'LittleLemonAPI_order', ['PRIMARY KEY']),
+        ('crew', '/api/orders?status=0', 'LittleLemonAPI_order', [
+            'order_crew_date_idx', 'order_crew_total_idx', 'order_status_date_idx',
+        ]),
+        ('crew', '/api/orders?cursor=', 'LittleLemonAPI_order', ['order_crew_date_idx']),
+        ('crew', '/api/orders?cursor=&ordering=total', 'LittleLemonAPI_order', ['order_crew_total_idx']),
+        ('manager', '/api/orders?status=0', 'LittleLemonAPI_order', ['order_status_date_idx']),
+        ('manager', '/api/orders?status=0&cursor=', 'LittleLemonAPI_order', ['order_status_date_idx']),
+        ('customer', '/api/menu-items?category={category}', 'LittleLemonAPI_menuitem', ['menuitem_category_price_idx']),
+        ('customer', '/api/menu-items?category={category}&ordering=price', 'LittleLemonAPI_menuitem', [
+            'menuitem_category_price_idx',
+        ]),
+        ('manager', '/api/reports/sales?date__gte=2023-01-01', 'LittleLemonAPI_dailysales', [
+            'LittleLemonAPI_dailysales_date_d62b8f17',
+        ]),
+    ]
+    # requests that read the whole table anyway, walked in index order up to the page size
+    whole_table_requests = [
+        ('manager', '/api/orders', 'LittleLemonAPI_order', []),
+        ('manager', '/api/orders?cursor=', 'LittleLemonAPI_order', ['LittleLemonAPI_order_date_f8faabe7']),
+        ('manager', '/api/orders?cursor=&ordering=total', 'LittleLemonAPI_order', ['order_total_idx']),
+        ('customer', '/api/menu-items?ordering=-price', 'LittleLemonAPI_menuitem', [
+            'LittleLemonAPI_menuitem_price_a4578e46',
+        ]),
+    ]
+    # a table read whole, bare or through an index; subqueries are the planner's own
+    full_scan = re.compile(r'^SCAN (?!(?i:subquery)\b)|USE TEMP B-TREE FOR ORDER BY')
+    used_index = re.compile(r'USING (?:COVERING )?INDEX (\S+)|USING INTEGER (PRIMARY KEY)')
+
+    def setUp(self):
+        super().setUp()
+        self.users = {
+            'customer': self.customer,
+            'crew': User.objects.create_user('crew', password='secret'),
+            'manager': User.objects.create_user('manager', password='secret'),
+        }
+        self.users['crew'].groups.add(Group.objects.create(name='Delivery crew'))
+        self.users['manager'].groups.add(Group.objects.create(name='Manager'))
+        self.fill_cart(self.customer, 3)
+        self.order = OrderSerializer().create({'user': self.customer})
+        Order.objects.filter(pk=self.order.pk).update(delivery_crew=self.users['crew'])
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            # older SQLite versions write SCAN TABLE and SEARCH TABLE
+            return [re.sub(r'^(SCAN|SEARCH) TABLE ', r'\1 ', row[-1]) for row in cursor.fetchall()]
+
+    def test_hot_queries_use_indexes(self):
+        requests = [(*request, False) for request in self.hot_requests]
+        requests += [(*request, True) for request in self.whole_table_requests]
+        for role, path, table, indexes, whole_table in requests:
+            path = path.format(order=self.order.pk, category=self.category.pk)
+            self.client.force_authenticate(self.users[role])
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(path).status_code, 200, path)
+            used = set()
+            for query in queries.captured_queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                plan = self.explain(query['sql'])
+                with self.subTest(role=role, path=path, sql=query['sql'][:120]):
+                    for line in plan:
+                        if line.split()[1:2] == [table]:
+                            used.update(name for match in self.used_index.finditer(line) for name in match.groups() if name)
+                            self.assertFalse(line.startswith('SCAN') and not whole_table, plan)
+                        else:
+                            self.assertIsNone(self.full_scan.search(line), plan)
+            if indexes:
+                with self.subTest(role=role, path=path):
+                    self.assertTrue(used & set(indexes), used)
+
+
+class TokenBucketThrottleTest(APITestCase):
+
+    def test_orders_allow_a_burst_then_refill(self):
+        self.client.force_authenticate(self.customer)
+        for _ in range(5):
+            self.assertEqual(self.client.get('/api/orders').status_code, 200)
+        response = self.client.get('/api/orders')
+        self.assertEqual(response.status_code, 429)
+        # 5/minute refills a token every 12 seconds
+        self.assertAlmostEqual(int(response['Retry-After']), 12, delta=1)
+
+    def test_workers_share_the_buckets(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'throttle.sqlite3')
+            # two processes' stores, each with its own connection to the file
+            first, second = TokenBucketStore(path), TokenBucketStore(path)
+            self.assertIsNone(first.take('throttle_user_1', capacity=2, rate=1, now=100))
+            self.assertIsNone(second.take('throttle_user_1', capacity=2, rate=1, now=100))
+            self.assertEqual(first.take('throttle_user_1', capacity=2, rate=1, now=100.25), 0.75)
+            self.assertIsNone(second.take('throttle_user_1', capacity=2, rate=1, now=101))
+            self.assertIsNone(first.take('throttle_user_2', capacity=2, rate=1, now=102))
+
+            first.prune('throttle_user_', idle=2, now=103.5)
+            self.assertEqual(second.connection.execute('SELECT key FROM buckets').fetchall(), [('throttle_user_2',)])
+
+
+class CachedTokenAuthenticationTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.make_menu(2)
+        self.token = Token.objects.create(user=self.customer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_steady_state_needs_no_auth_queries(self):
+        self.client.get('/api/menu-items')
+        # the menu page comes from the catalog cache, only authentication could query
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/menu-items').status_code, 200)
+
+    def test_each_request_gets_its_own_user(self):
+        first, _ = CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        first.first_name = 'changed by a view'
+        second, _ = CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        self.assertIsNot(first, second)
+        self.assertEqual(second.first_name, '')
+
+    def test_logout_revokes_the_cached_token(self):
+        self.client.get('/api/menu-items')
+        self.assertEqual(self.client.post('/auth/token/logout/').status_code, 204)
+        self.assertEqual(self.client.get('/api/menu-items').status_code, 401)
+
+    def test_deactivation_and_group_changes_reach_cached_users(self):
+        self.client.get('/api/menu-items')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.groups.add(Group.objects.create(name='Manager'))
+        user, _ = CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        self.assertTrue(IsManager(user))
+
+        self.customer.is_active = False
+        self.customer.save()
+        self.assertEqual(self.client.get('/api/menu-items').status_code, 401)
+
+    def test_unreachable_cache_fails_closed(self):
+        CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        # deactivated without signals, as if the version bump never reached this worker
+        User.objects.filter(pk=self.customer.pk).update(is_active=False)
+        with mock.patch.object(caches['versions'], 'get', side_effect=ConnectionError), \
+                self.assertLogs('LittleLemonAPI.authentication', 'WARNING'):
+            with self.assertRaises(AuthenticationFailed):
+                CachedTokenAuthentication().authenticate_credentials(self.token.key)
+            User.objects.filter(pk=self.customer.pk).update(is_active=True)
+            user, _ = CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        self.assertTrue(user.is_active)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'the search index is an SQLite FTS5 table')
+class MenuSearchTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.customer)
+        desserts = Category.objects.create(slug='desserts', title='Desserts')
+        MenuItem.objects.bulk_create([
+            MenuItem(title='Grilled Lamb Souvlaki', price=Decimal('12.00'), featured=False, category=self.category),
+            MenuItem(title='Chicken Souvlaki Pita', price=Decimal('9.00'), featured=False, category=self.category),
+            MenuItem(title='Lemon Baklava', price=Decimal('5.00'), featured=False, category=desserts),
+        ])
+
+    def search(self, q, **params):
+        response = self.client.get('/api/menu-items/search', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.data]
+
+    def test_prefix_and_substring(self):
+        self.assertCountEqual(self.search('souv'), ['Grilled Lamb Souvlaki', 'Chicken Souvlaki Pita'])
+        self.assertEqual(self.search('bak'), ['Lemon Baklava'])
+        self.assertEqual(self.search('le'), ['Lemon Baklava'])
+
+    def test_typos_and_ranking(self):
+        self.assertEqual(self.search('chiken'), ['Chicken Souvlaki Pita'])
+        self.assertEqual(self.search('baklawa'), ['Lemon Baklava'])
+        # a title hit ranks above a category hit
+        dessert = Category.objects.get(slug='desserts')
+        MenuItem.objects.create(title='Dessert Platter', price=Decimal('7.00'), featured=False, category=dessert)
+        self.assertEqual(self.search('dessert')[0], 'Dessert Platter')
+        self.assertEqual(self.search('zzzz'), [])
+
+    def test_word_starts_rank_above_word_insides(self):
+        # the short title is the better bm25 match, the title word starting with the query wins
+        MenuItem.objects.create(title='Clambake', price=Decimal('11.00'), featured=False, category=self.category)
+        self.assertEqual(self.search('lamb'), ['Grilled Lamb Souvlaki', 'Clambake'])
+        self.assertEqual(self.search('lamb', limit=1), ['Grilled Lamb Souvlaki'])
+
+    def test_index_follows_writes(self):
+        item = MenuItem.objects.get(title='Lemon Baklava')
+        item.title = 'Orange Baklava'
+        item.save()
+        self.assertEqual(self.search('orange'), ['Orange Baklava'])
+        self.assertEqual(self.search('lemon'), [])
+
+        Category.objects.filter(slug='desserts').update(title='Sweets')
+        self.assertEqual(self.search('sweets'), ['Orange Baklava'])
+
+        MenuItem.objects.filter(title='Orange Baklava').delete()
+        self.assertEqual(self.search('baklava'), [])
+
+    def test_bulk_import_is_searchable(self):
+        import_rows = [{'title': 'Halloumi Salad', 'price': '8.00', 'featured': False, 'category': 'mains'}]
+        self.client.force_authenticate(User.objects.create_superuser('admin', password='secret'))
+        self.assertEqual(self.client.post('/api/menu-items/bulk', import_rows, format='json').status_code, 200)
+        self.assertEqual(self.search('halloumi'), ['Halloumi Salad'])
+
+    def test_limit(self):
+        self.assertEqual(len(self.search('souvlaki', limit=1)), 1)
+
+
+class DispatchTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.delivery = Group.objects.create(name='Delivery crew')
+        self.crew = [User.objects.create_user(f'crew-{i}', password='secret') for i in range(3)]
+        self.delivery.user_set.add(*self.crew)
+        self.manager = User.objects.create_user('manager', password='secret')
+        self.manager.groups.add(Group.objects.create(name='Manager'))
+
+    def place_order(self):
+        self.fill_cart(self.customer, 1)
+        self.client.force_authenticate(self.customer)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/orders')
+        self.assertEqual(response.status_code, 201)
+        return Order.objects.get(pk=response.data['id'])
+
+    def test_checkout_assigns_the_least_loaded_crew_member(self):
+        Order.objects.bulk_create([Order(user=self.customer, delivery_crew=self.crew[0]) for _ in range(2)])
+        Order.objects.create(user=self.customer, delivery_crew=self.crew[1])
+        crew = [self.place_order().delivery_crew for _ in range(4)]
+        self.assertEqual(crew, [self.crew[2], self.crew[1], self.crew[2], self.crew[0]])
+
+    def test_delivered_and_reassigned_orders_free_their_crew_member(self):
+        first, second, third = [self.place_order() for _ in range(3)]
+        self.client.force_authenticate(self.crew[0])
+        self.assertEqual(self.client.patch(f'/api/orders/{first.pk}', {'status': True}).status_code, 200)
+        self.assertEqual(self.place_order().delivery_crew, self.crew[0])
+
+        self.client.force_authenticate(self.manager)
+        response = self.client.patch(f'/api/orders/{second.pk}', {'delivery_crew': self.crew[2].pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.place_order().delivery_crew, self.crew[1])
+
+    def test_new_crew_members_get_orders_at_once(self):
+        for _ in self.crew:
+            self.place_order()
+        newcomer = User.objects.create_user('newcomer', password='secret')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.delivery.user_set.add(newcomer)
+        self.assertEqual(self.place_order().delivery_crew, newcomer)
+
+    def test_checkouts_before_a_commit_spread_over_the_crew(self):
+        self.fill_cart(self.customer, 1)
+        lines = cart_lines(self.customer)
+        # one transaction stands in for checkouts that have not committed yet
+        with transaction.atomic():
+            orders = [place_order(self.customer, lines) for _ in self.crew]
+        self.assertEqual({order.delivery_crew for order in orders}, set(self.crew))
+
+    def test_rolled_back_checkout_is_not_counted(self):
+        self.place_order()
+        dispatcher.reload()
+        loads = dict(dispatcher.loads)
+        self.fill_cart(self.customer, 1)
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch('LittleLemonAPI.checkout.add_daily_sales', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                checkout_cart(self.customer)
+        self.assertEqual(dispatcher.loads, loads)
+        self.assertEqual(self.place_order().delivery_crew, self.crew[1])
+
+    def test_dispatch_off(self):
+        with self.settings(DISPATCH_AT_CHECKOUT=False):
+            self.assertIsNone(self.place_order().delivery_crew)
+
+    def test_dispatch_orders_assigns_and_rebalances(self):
+        Order.objects.bulk_create([Order(user=self.customer, delivery_crew=self.crew[0]) for _ in range(7)])
+        Order.objects.bulk_create([Order(user=self.customer) for _ in range(2)])
+        Order.objects.create(user=self.customer, delivery_crew=self.crew[1], status=True)
+        output = io.StringIO()
+        call_command('dispatch_orders', rebalance=True, stdout=output)
+        open_orders = Order.objects.filter(status=False)
+        self.assertFalse(open_orders.filter(delivery_crew__isnull=True).exists())
+        self.assertEqual(
+            sorted(open_orders.values('delivery_crew').annotate(open=Count('id')).values_list('open', flat=True)),
+            [3, 3, 3],
+        )
+        self.assertIn('3 to 3 open orders', output.getvalue())
+
+
+class OrderEventsTest(TransactionTestCase):
+    # the feed polls from its own thread, it only sees committed rows
+
+    def setUp(self):
+        clear_caches()
+        poll = self.settings(ORDER_EVENTS_POLL_SECONDS=0.02, DISPATCH_AT_CHECKOUT=False)
+        poll.enable()
+        self.addCleanup(poll.disable)
+        self.customer = User.objects.create_user('customer', password='secret')
+        self.orders = [Order.objects.create(user=self.customer) for _ in range(2)]
+        self.token = Token.objects.create(user=self.customer).key
+
+    async def poll(self, order, token=None, **params):
+        return await AsyncClient().get(
+            f'/api/orders/{order.pk}/events', params, AUTHORIZATION=f'Token {token or self.token}',
+        )
+
+    async def change(self, order, **fields):
+        for name, value in fields.items():
+            setattr(order, name, value)
+        await sync_to_async(order.save)()
+
+    async def test_missed_events_come_back_at_once(self):
+        response = await self.poll(self.orders[0], after=0)
+        self.assertEqual(response.status_code, 200)
+        events = response.json()['events']
+        self.assertEqual([(event['order'], event['status']) for event in events], [(self.orders[0].pk, False)])
+        self.assertEqual(response.json()['cursor'], events[-1]['id'])
+
+    async def test_waiting_clients_wake_on_change(self):
+        cursor = (await self.poll(self.orders[0], timeout=0)).json()['cursor']
+        # held requests are not slow ones, their wait is reported apart
+        with self.assertNoLogs('LittleLemonAPI.middleware'):
+            waiting = [asyncio.create_task(self.poll(self.orders[0], after=cursor)) for _ in range(5)]
+            other = asyncio.create_task(self.poll(self.orders[1], after=cursor, timeout=1))
+            await asyncio.sleep(0.2)
+            self.assertEqual(len([thread for thread in threading.enumerate() if thread.name == 'order-feed']), 1)
+            await self.change(self.orders[0], status=True)
+
+            responses = await asyncio.wait_for(asyncio.gather(*waiting), 5)
+            for response in responses:
+                self.assertEqual([event['status'] for event in response.json()['events']], [True])
+            # the other order's client heard nothing
+            response = await other
+        self.assertEqual(response.json(), {'cursor': cursor, 'events': []})
+        self.assertIn('idle;dur=', response['Server-Timing'])
+
+    async def test_deletes_are_events_too(self):
+        cursor = (await self.poll(self.orders[0], timeout=0)).json()['cursor']
+        waiting = asyncio.create_task(self.poll(self.orders[0], after=cursor))
+        await asyncio.sleep(0.2)
+        await sync_to_async(self.orders[0].delete)()
+        self.assertTrue((await asyncio.wait_for(waiting, 5)).json()['events'][0]['deleted'])
+        self.assertEqual((await self.poll(self.orders[0], after=cursor)).status_code, 404)
+
+    async def test_feed_hands_out_only_unseen_events(self):
+        latest = (await self.poll(self.orders[0], timeout=0)).json()['cursor']
+        order_feed = OrderFeed()
+        # a client far behind does not send the feed back over old events
+        future = await order_feed.subscribe(self.orders[0].pk, 0)
+        self.assertEqual(order_feed.last_id, latest)
+        order_feed.unsubscribe(self.orders[0].pk, future)
+
+        future = await order_feed.subscribe(self.orders[0].pk, latest)
+        order_feed.publish([{'id': latest, 'order': self.orders[0].pk}])
+        await asyncio.sleep(0.05)
+        self.assertFalse(future.done())
+        order_feed.publish([{'id': latest, 'order': self.orders[0].pk}, {'id': latest + 1, 'order': self.orders[0].pk}])
+        self.assertEqual(await asyncio.wait_for(future, 5), [{'id': latest + 1, 'order': self.orders[0].pk}])
+
+    async def test_events_are_written_on_commit(self):
+        cursor = (await self.poll(self.orders[0], timeout=0)).json()['cursor']
+
+        @sync_to_async
+        def change():
+            with transaction.atomic():
+                self.orders[0].status = True
+                self.orders[0].save()
+                # no id is taken while the change is invisible to the feed
+                self.assertFalse(OrderEvent.objects.filter(id__gt=cursor).exists())
+        await change()
+        events = (await self.poll(self.orders[0], after=cursor, timeout=0)).json()['events']
+        self.assertEqual([event['status'] for event in events], [True])
+
+    async def test_permissions_and_parameters(self):
+        other = await sync_to_async(User.objects.create_user)('other', password='secret')
+        token = await Token.objects.acreate(user=other)
+        self.assertEqual((await self.poll(self.orders[0], token=token.key, timeout=0)).status_code, 403)
+        self.assertEqual((await self.poll(self.orders[0], after='latest')).status_code, 400)
+        self.assertEqual((await AsyncClient().get(f'/api/orders/{self.orders[0].pk}/events')).status_code, 401)
+
+
+class CheckoutJobTest(TransactionTestCase):
+    # the worker closes stale connections between batches, which a test transaction would not survive
+
+    def setUp(self):
+        clear_caches()
+        throttle_store = self.settings(THROTTLE_STORE=':memory:', DISPATCH_AT_CHECKOUT=False, CHECKOUT_JOB_RETRY_SECONDS=0)
+        throttle_store.enable()
+        self.addCleanup(throttle_store.disable)
+        get_store().clear()
+        self.client = APIClient()
+        self.customer = User.objects.create_user('customer', password='secret')
+        self.client.force_authenticate(self.customer)
+        category = Category.objects.create(slug='mains', title='Mains')
+        self.items = MenuItem.objects.bulk_create([
+            MenuItem(title=f'Dish {i}', price=Decimal('2.50') + i, featured=False, category=category) for i in range(3)
+        ])
+        Cart.objects.bulk_create([Cart(user=self.customer, menuitem=item, quantity=2) for item in self.items])
+
+    def enqueue(self):
+        response = self.client.post('/api/orders', HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 202)
+        return response
+
+    def work(self):
+        call_command('run_checkout_jobs', once=True, stdout=io.StringIO())
+
+    def test_queued_checkout_is_placed_by_the_worker(self):
+        response = self.enqueue()
+        self.assertEqual(response['Preference-Applied'], 'respond-async')
+        self.assertEqual(response.data['status'], CheckoutJob.QUEUED)
+        # the cart is taken at once, the order comes later
+        self.assertFalse(Cart.objects.filter(user=self.customer).exists())
+        self.assertFalse(Order.objects.exists())
+
+        self.work()
+        job = self.client.get(response['Location']).data
+        self.assertEqual((job['status'], job['attempts']), (CheckoutJob.DONE, 1))
+        order = Order.objects.get(pk=job['order'])
+        self.assertEqual((order.user, order.total), (self.customer, Decimal('2.50') * 2 + Decimal('3.50') * 2 + Decimal('4.50') * 2))
+        self.assertEqual(order.order_items.count(), 3)
+
+    def test_checkout_async_setting_queues_without_header(self):
+        with self.settings(CHECKOUT_ASYNC=True):
+            self.assertEqual(self.client.post('/api/orders').status_code, 202)
+        self.assertEqual(CheckoutJob.objects.get().status, CheckoutJob.QUEUED)
+
+    def test_failed_attempt_is_retried(self):
+        job_id = self.enqueue().data['id']
+        failures = [RuntimeError('database away')]
+
+        def flaky_place_order(user, lines):
+            if failures:
+                raise failures.pop()
+            return place_order(user, lines)
+
+        with mock.patch('LittleLemonAPI.checkout.place_order', flaky_place_order), \
+                self.assertLogs('LittleLemonAPI.checkout', 'ERROR'):
+            self.work()
+        job = CheckoutJob.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.attempts, job.error), (CheckoutJob.DONE, 2, ''))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_cart_comes_back_after_the_last_attempt(self):
+        job_id = self.enqueue().data['id']
+        with self.settings(CHECKOUT_JOB_ATTEMPTS=2), \
+                mock.patch('LittleLemonAPI.checkout.place_order', side_effect=RuntimeError('database away')), \
+                self.assertLogs('LittleLemonAPI.checkout', 'ERROR') as logs:
+            self.work()
+        self.assertEqual(len(logs.records), 2)
+        job = CheckoutJob.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.attempts, job.error), (CheckoutJob.FAILED, 2, 'RuntimeError: database away'))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Cart.objects.filter(user=self.customer).count(), 3)
+
+    def test_restored_lines_add_to_the_new_cart(self):
+        self.enqueue()
+        Cart.objects.create(user=self.customer, menuitem=self.items[0], quantity=1)
+        with self.settings(CHECKOUT_JOB_ATTEMPTS=1), \
+                mock.patch('LittleLemonAPI.checkout.place_order', side_effect=RuntimeError('database away')), \
+                self.assertLogs('LittleLemonAPI.checkout', 'ERROR'):
+            self.work()
+        self.assertEqual(
+            list(Cart.objects.filter(user=self.customer).order_by('menuitem').values_list('quantity', flat=True)),
+            [3, 2, 2],
+        )
+
+    def test_a_job_is_placed_once_by_its_latest_claim(self):
+        job_id = self.enqueue().data['id']
+        [stale] = claim_checkout_jobs(10)
+        self.assertEqual(claim_checkout_jobs(10), [])
+        # the first worker looks dead, another one claims the job again
+        CheckoutJob.objects.filter(pk=job_id).update(updated=stale.updated - datetime.timedelta(hours=1))
+        [current] = claim_checkout_jobs(10)
+        self.assertNotEqual(current.claim, stale.claim)
+
+        with self.assertLogs('LittleLemonAPI.checkout', 'WARNING'):
+            self.assertFalse(run_checkout_job(stale))
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(run_checkout_job(current))
+        job = CheckoutJob.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.attempts, job.order), (CheckoutJob.DONE, 2, Order.objects.get()))
+
+    def test_jobs_of_others_are_not_found(self):
+        location = self.enqueue()['Location']
+        other = User.objects.create_user('other', password='secret')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(location).status_code, 404)
+        self.assertEqual(self.client.post('/api/orders', HTTP_PREFER='respond-async').status_code, 404)
@@ -0,0 +1,122 @@
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+from rest_framework.throttling import AnonRateThrottle, ScopedRateThrottle, UserRateThrottle
+
+
+class TokenBucketStore:
+    """
+    Token buckets in a SQLite file every worker process opens, one row of
+    (key, tokens, updated) per client. A check is a single upsert that refills
+    the bucket for the time passed and takes a token if there is one, SQLite
+    runs it atomically so workers never hand out the same token twice.
+    """
+    take_sql = '''
+        INSERT INTO buckets (key, tokens, updated) VALUES (:key, :capacity - 1, :now)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = MIN(:capacity, tokens + (:now - updated) * :rate) - 1,
+            updated = :now
+        WHERE MIN(:capacity, tokens + (:now - updated) * :rate) >= 1
+        RETURNING tokens
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            # losing the last moments of throttle state in a crash is fine, waiting on fsync is not
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS buckets '
+                '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID'
+            )
+            self.local.connection = connection
+        return connection
+
+    def take(self, key, capacity, rate, now=None):
+        """Take a token, returns None when allowed, else the seconds until the next token."""
+        now = time.time() if now is None else now
+        params = {'key': key, 'capacity': capacity, 'rate': rate, 'now': now}
+        if self.connection.execute(self.take_sql, params).fetchone() is not None:
+            return None
+        row = self.connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', [key]).fetchone()
+        tokens = min(capacity, row[0] + (now - row[1]) * rate) if row else capacity
+        return max(0.0, (1 - tokens) / rate)
+
+    def prune(self, prefix, idle, now=None):
+        # buckets idle this long are full again, a missing row means the same
+        now = time.time() if now is None else now
+        self.connection.execute(
+            'DELETE FROM buckets WHERE key >= ? AND key < ? AND updated < ?',
+            [prefix, prefix + '\uffff', now - idle],
+        )
+
+    def clear(self):
+        self.connection.execute('DELETE FROM buckets')
+
+
+stores = {}
+
+
+def get_store():
+    path = str(settings.THROTTLE_STORE)
+    if path not in stores:
+        stores[path] = TokenBucketStore(path)
+    return stores[path]
+
+
+class TokenBucketMixin:
+    """
+    Token bucket variant of a SimpleRateThrottle: `num/period` allows bursts
+    of num requests refilled at num per period, with state shared by all
+    workers through the TokenBucketStore instead of per-process timestamp
+    lists in the cache.
+    """
+    prune_chance = 0.001
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        store = get_store()
+        capacity, rate = self.num_requests, self.num_requests / self.duration
+        if random.random() < self.prune_chance:
+            store.prune(self.cache_format % {'scope': self.scope, 'ident': ''}, capacity / rate)
+        self.wait_seconds = store.take(self.key, capacity, rate)
+        return self.wait_seconds is None
+
+    def wait(self):
+        return getattr(self, 'wait_seconds', None)
+
+
+class AnonBucketThrottle(TokenBucketMixin, AnonRateThrottle):
+    pass
+
+
+class UserBucketThrottle(TokenBucketMixin, UserRateThrottle):
+    pass
+
+
+class ScopedBucketThrottle(TokenBucketMixin, ScopedRateThrottle):
+
+    def allow_request(self, request, view):
+        # the rate comes from the view's throttle_scope, as in ScopedRateThrottle
+        self.scope = getattr(view, self.scope_attr, None)
+        if not self.scope:
+            return True
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
@@ -1,10 +1,12 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
 
     # class-view base approach
     path('menu-items', views.MenuItemView.as_view()),
+    path('menu-items/bulk', views.MenuItemBulkView.as_view()),
+    path('menu-items/search', views.MenuItemSearchView.as_view()),
     path('menu-items/<int:pk>', views.MenuItemDetailView.as_view()),
     path('category', views.CategoryView.as_view()),
     path('category/<int:pk>', views.CategoryDetail.as_view()),
@@ -14,7 +16,20 @@ urlpatterns = [
     path('groups/delivery-crew/users/<int:pk>', views.DeliveryViewDetail.as_view()),
     path('cart/menu-items', views.CartView.as_view()),
     path('orders', views.OrderView.as_view()),
+    path('orders/export', views.OrderExportView.as_view()),
+    path('orders/jobs/<int:pk>', views.CheckoutJobView.as_view(), name='checkout-job'),
     path('orders/<int:pk>', views.OrderDerailView.as_view()),
+    path('orders/<int:pk>/events', async_views.OrderEventsView.as_view()),
+    path('reports/sales', views.SalesReportView.as_view()),
+    path('reports/top-sellers', views.TopSellersView.as_view()),
+
+    # async read paths for ASGI, same output as the views above
+    path('async/menu-items', async_views.MenuItemListView.as_view()),
+    path('async/menu-items/<int:pk>', async_views.MenuItemDetailView.as_view()),
+    path('async/category', async_views.CategoryListView.as_view()),
+    path('async/category/<int:pk>', async_views.CategoryDetailView.as_view()),
+    path('async/orders', async_views.OrderListView.as_view()),
+    path('async/orders/<int:pk>', async_views.OrderDetailView.as_view()),
 
 
     # function-view based approach
@@ -1,49 +1,182 @@
+from django.conf import settings
 from django.contrib.auth.models import User, Group
 from django.core.paginator import Paginator, EmptyPage
-from django_filters.rest_framework import DjangoFilterBackend
-from django.http import Http404
+from django_filters.rest_framework import BooleanFilter, DjangoFilterBackend, FilterSet
+from django.db.models import Sum
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
 
 from rest_framework import status, generics, viewsets
 from rest_framework import filters
 from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import IsAuthenticated, DjangoModelPermissions
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
 
-from .models import Category, MenuItem, Order, OrderItem, Cart
-from .serializers import MenuItemSerializer, UserSerializer, CartSerializer, OrderSerializer, OrderItemSerializer, UpdateDeliverCrewSerializer, UpdateStatusSerializer, CategorySerializer
-from .permissions import CustomDjangoModelPermission, IsAdminUserOrManager, IsManager, IsDeliveryCrew, IsDeliweryCrewPermission, IsOrderOwner
-
-class OrderView(generics.ListCreateAPIView):
+from .checkout import enqueue_checkout
+from .caching import CatalogCacheMixin, CatalogETagMixin, ConditionalGetMixin, ORDERS_VERSION_KEY, get_catalog_version, get_version, request_fingerprint, user_orders_version_key
+from .dispatch import dispatcher
+from .exports import csv_lines, ndjson_lines, spool_lines
+from .fastlists import ValuesListMixin
+from .routers import ReplicaReadMixin
+from .throttling import AnonBucketThrottle, UserBucketThrottle
+from .importers import import_menu_items
+from .models import Category, CheckoutJob, MenuItem, Order, OrderItem, Cart, DailySales
+from .pagination import CartPagination, OrderPagination
+from .parsers import CSVParser
+from .renderers import NDJSONRenderer, CSVRenderer
+from .search import search_menu_items
+from .serializers import CheckoutJobSerializer, MenuItemSerializer, UserSerializer, CartSerializer, CartLineSerializer, OrderSerializer, OrderItemSerializer, UpdateDeliverCrewSerializer, UpdateStatusSerializer, CategorySerializer, DailyRevenueSerializer, TopSellerSerializer
+from .permissions import IsAdminUserOrManager, IsManager, IsDeliveryCrew, IsDeliweryCrewPermission, IsOrderOwner, get_roles, invalidate_roles, order_users
+
+def orders_version(user):
+    # managers and staff see every order, anyone else those they own or deliver
+    if IsManager(user) or user.is_staff:
+        return get_version(ORDERS_VERSION_KEY)
+    return get_version(user_orders_version_key(user.pk))
+
+
+class OrderFilter(FilterSet):
+    # status=0 filters as a bare NOT "status", which no index serves; IN (0) searches order_status_date_idx
+    status = BooleanFilter(method='filter_status')
+
+    class Meta:
+        model = Order
+        fields = ['delivery_crew', 'status', 'date', 'total']
+
+    def filter_status(self, queryset, name, value):
+        return queryset.filter(status__in=[value])
+
+
+class OrderView(ReplicaReadMixin, ConditionalGetMixin, ValuesListMixin, generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
-    throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    throttle_classes = [AnonBucketThrottle, UserBucketThrottle]
     serializer_class = OrderSerializer
+    values_serialization = True
+    values_nested = {'order_items': (OrderItemSerializer, 'order')}
+    pagination_class = OrderPagination
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     ordering_fields = ['total', 'date']
-    filterset_fields = ['delivery_crew', 'status', 'date', 'total']
+    filterset_class = OrderFilter
 
     
     def get_queryset(self):
+        # ?fields= without order_items skips their prefetch
+        orders = Order.objects.with_items() if 'order_items' in self.get_serializer().fields else Order.objects.all()
         if IsDeliveryCrew(self.request.user):
-            return Order.objects.filter(delivery_crew = self.request.user)
+            return orders.filter(delivery_crew = self.request.user)
         elif IsManager(self.request.user):
-            return Order.objects.all()
+            return orders
         else:
-            return Order.objects.filter(user=self.request.user)
+            return orders.filter(user=self.request.user)
+
+    def allow_replica(self, request):
+        # order writes pin their owner and crew, a manager's list holds everyone's orders
+        return not IsManager(request.user) and super().allow_replica(request)
+
+    def get_etag_parts(self, request, *args, **kwargs):
+        # the role picks the orders, menu item titles are part of their items
+        return [
+            orders_version(request.user), get_catalog_version(),
+            request.user.pk, sorted(get_roles(request.user)), request_fingerprint(request),
+        ]
     
 
+    def create(self, request, *args, **kwargs):
+        # Prefer: respond-async (RFC 7240) queues the checkout, the 202 points at the job
+        prefer = {token.strip() for token in request.headers.get('Prefer', '').lower().replace(';', ',').split(',')}
+        if not (getattr(settings, 'CHECKOUT_ASYNC', False) or 'respond-async' in prefer):
+            return super().create(request, *args, **kwargs)
+        job = enqueue_checkout(request.user)
+        return Response(CheckoutJobSerializer(job).data, status=status.HTTP_202_ACCEPTED, headers={
+            'Location': reverse('checkout-job', kwargs={'pk': job.pk}), 'Preference-Applied': 'respond-async',
+        })
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
+class CheckoutJobView(generics.RetrieveAPIView):
+    """State of an async checkout, `order` is set once it is placed."""
+    serializer_class = CheckoutJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        if IsManager(self.request.user):
+            return CheckoutJob.objects.all()
+        return CheckoutJob.objects.filter(user=self.request.user)
+
+
+class OrderExportView(generics.GenericAPIView):
+    queryset = Order.objects.all()
+    permission_classes = [IsAdminUserOrManager]
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = OrderFilter
+    pagination_class = None
+
+    def get(self, request, *args, **kwargs):
+        # ?format=csv or Accept: text/csv, NDJSON otherwise
+        orders = self.filter_queryset(self.get_queryset())
+        if request.accepted_renderer.format == 'csv':
+            lines = csv_lines(orders)
+        else:
+            lines = ndjson_lines(orders)
+        if isinstance(request._request, ASGIRequest):
+            # Django 4.1 iterates a streaming body on the event loop, where the ORM
+            # refuses to run; the export is written out here, in the view's thread
+            response = FileResponse(spool_lines(lines), content_type=request.accepted_renderer.media_type)
+        else:
+            response = StreamingHttpResponse(lines, content_type=request.accepted_renderer.media_type)
+        response['Content-Disposition'] = f'attachment; filename="orders.{request.accepted_renderer.format}"'
+        return response
+
+
+class SalesReportView(generics.ListAPIView):
+    serializer_class = DailyRevenueSerializer
+    permission_classes = [IsAdminUserOrManager]
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = {'date': ['gte', 'lte']}
+
+    def get_queryset(self):
+        return DailySales.objects.values('date').annotate(
+            total_quantity=Sum('quantity'), total_revenue=Sum('revenue'),
+        ).order_by('-date')
+
+
+class TopSellersView(generics.ListAPIView):
+    serializer_class = TopSellerSerializer
+    permission_classes = [IsAdminUserOrManager]
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = {'date': ['gte', 'lte']}
+
+    def get_queryset(self):
+        return DailySales.objects.values('menuitem', 'menuitem__title').annotate(
+            total_orders=Sum('orders'), total_quantity=Sum('quantity'), total_revenue=Sum('revenue'),
+        ).order_by('-total_quantity', 'menuitem')
+
+
 # class based views
-class CartView(generics.ListCreateAPIView, generics.DestroyAPIView):
+class CartView(ValuesListMixin, generics.ListCreateAPIView, generics.DestroyAPIView):
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated]
+    values_serialization = True
+    pagination_class = CartPagination
 
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user)
+        return Cart.objects.filter(user=self.request.user).with_prices().select_related('user').order_by('id')
+
+    def create(self, request, *args, **kwargs):
+        # a list of {menuitem, quantity} lines replaces those lines in one go
+        if not isinstance(request.data, list):
+            return super().create(request, *args, **kwargs)
+        serializer = CartLineSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user)
+        return self.list(request, *args, **kwargs)
     
     def delete(self, request, *args, **kwargs):
         cart = self.get_queryset()
@@ -65,6 +198,7 @@ class DeliveryView(generics.ListAPIView, generics.CreateAPIView):
             user = get_object_or_404(User, username=username)
             managers = Group.objects.get(name='Delivery crew')
             managers.user_set.add(user)
+            invalidate_roles(user.pk)
             serialized_user = UserSerializer(user)
             return Response(serialized_user.data, status.HTTP_201_CREATED)
         else:
@@ -80,6 +214,7 @@ class DeliveryViewDetail(generics.RetrieveDestroyAPIView):
         user = self.get_object()
         managers = Group.objects.get(name='Delivery crew')
         managers.user_set.remove(user)
+        invalidate_roles(user.pk)
         serialized_user = UserSerializer(user)
         return Response(serialized_user.data, status.HTTP_200_OK)
 
@@ -95,6 +230,7 @@ class ManagerView(generics.ListAPIView, generics.CreateAPIView):
             user = get_object_or_404(User, username=username)
             managers = Group.objects.get(name='Manager')
             managers.user_set.add(user)
+            invalidate_roles(user.pk)
             serialized_user = UserSerializer(user)
             return Response(serialized_user.data, status.HTTP_201_CREATED)
         else:
@@ -110,13 +246,16 @@ class ManagerViewDetail(generics.RetrieveDestroyAPIView):
         user = self.get_object()
         managers = Group.objects.get(name='Manager')
         managers.user_set.remove(user)
+        invalidate_roles(user.pk)
         serialized_user = UserSerializer(user)
         return Response(serialized_user.data, status.HTTP_200_OK)
 
 
-class CategoryView(generics.ListCreateAPIView):
+class CategoryView(ReplicaReadMixin, CatalogETagMixin, CatalogCacheMixin, ValuesListMixin, generics.ListCreateAPIView):
+    replica_scope = 'catalog'
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    values_serialization = True
 
     def get_permission(self):
         if self.request.method == 'GET':
@@ -124,7 +263,7 @@ class CategoryView(generics.ListCreateAPIView):
         return [IsAdminUserOrManager]
     
 
-class CategoryDetail(generics.RetrieveUpdateDestroyAPIView):
+class CategoryDetail(CatalogETagMixin, CatalogCacheMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     
@@ -134,9 +273,11 @@ class CategoryDetail(generics.RetrieveUpdateDestroyAPIView):
         return [IsAdminUserOrManager]
 
 
-class MenuItemView(generics.ListCreateAPIView):
+class MenuItemView(ReplicaReadMixin, CatalogETagMixin, CatalogCacheMixin, ValuesListMixin, generics.ListCreateAPIView):
+    replica_scope = 'catalog'
     queryset = MenuItem.objects.all()
     serializer_class = MenuItemSerializer
+    values_serialization = True
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     ordering_fields = ['title', 'price', 'category']
     filterset_fields = ['title', 'price', 'category']
@@ -147,25 +288,88 @@ class MenuItemView(generics.ListCreateAPIView):
         return [IsAdminUserOrManager]
 
 
-class MenuItemDetailView(generics.RetrieveUpdateDestroyAPIView):
+class MenuItemSearchView(CatalogETagMixin, CatalogCacheMixin, generics.ListAPIView):
+    """?q= matches anywhere in menu item and category titles, close misspellings included, best first."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = MenuItemSerializer
+    default_limit = 20
+    max_limit = 50
+
+    def list(self, request, *args, **kwargs):
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            limit = self.default_limit
+        ids = search_menu_items(request.query_params.get('q', ''), max(limit, 1))
+        items = MenuItem.objects.select_related(*self.get_serializer().expanded_fields).in_bulk(ids)
+        serializer = self.get_serializer([items[pk] for pk in ids if pk in items], many=True)
+        return Response(serializer.data)
+
+
+class MenuItemBulkView(generics.GenericAPIView):
+    permission_classes = [IsAdminUserOrManager]
+    parser_classes = [*api_settings.DEFAULT_PARSER_CLASSES, CSVParser]
+
+    def post(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return Response({'message': 'Send a JSON array or CSV rows'}, 400)
+        result = import_menu_items(request.data)
+        if result['errors']:
+            return Response(result, status.HTTP_400_BAD_REQUEST)
+        return Response(result, status.HTTP_200_OK)
+
+
+class MenuItemDetailView(CatalogETagMixin, CatalogCacheMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = MenuItem.objects.all()
     serializer_class = MenuItemSerializer
 
+    def get_queryset(self):
+        return MenuItem.objects.select_related(*self.get_serializer().expanded_fields)
+
     def get_permission(self):
         if self.request.method == 'GET':
             return [IsAuthenticated]
         return [IsAdminUserOrManager]
 
 
-class OrderDerailView(generics.RetrieveUpdateDestroyAPIView):
+class OrderDerailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Order.objects.all()
     permission_classes = [IsOrderOwner | IsDeliweryCrewPermission | IsAdminUserOrManager]
+
+    def get_queryset(self):
+        # the update serializers and ?fields= may leave the items out, only join the users then
+        if 'order_items' in self.get_serializer().fields:
+            return Order.objects.with_items()
+        return Order.objects.select_related('user', 'delivery_crew')
+
+    def check_etag_permissions(self, request, *args, **kwargs):
+        # the users of the order are all the permission classes need
+        row = get_object_or_404(Order.objects.values('user', 'delivery_crew'), pk=kwargs['pk'])
+        self.check_object_permissions(request, order_users(row))
+
+    def get_etag_parts(self, request, *args, **kwargs):
+        # the serializer depends on the role, which the user alone does not tell
+        return [
+            orders_version(request.user), get_catalog_version(),
+            request.user.pk, self.get_serializer_class().__name__, request_fingerprint(request),
+        ]
     
+    def perform_update(self, serializer):
+        # keep the dispatch loads current, reassigned and delivered orders move them
+        before = None if serializer.instance.status else serializer.instance.delivery_crew_id
+        order = serializer.save()
+        dispatcher.order_changed(before, None if order.status else order.delivery_crew_id)
+
+    def perform_destroy(self, instance):
+        if not instance.status:
+            dispatcher.order_changed(instance.delivery_crew_id, None)
+        instance.delete()
+
     def get_serializer_class(self):
         user = self.request.user
         if IsManager(user) or user.is_staff:
             return UpdateDeliverCrewSerializer
-        elif IsDeliveryCrew:
+        elif IsDeliveryCrew(user):
             return UpdateStatusSerializer
         else:
             return OrderSerializer